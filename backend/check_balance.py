@@ -1,5 +1,6 @@
 """Quick script to check Binance Testnet balance"""
 from binance.client import Client
+import numpy as np
 import os
 import time
 from dotenv import load_dotenv
@@ -16,15 +17,20 @@ try:
 except Exception as e:
     print(f"Warning: Could not sync time: {e}")
 
-account = client.get_account()
+# Wider recvWindow tolerates testnet clock drift (-1021 errors)
+account = client.get_account(recvWindow=10000)
 
 print("\n=== BINANCE TESTNET ACCOUNT BALANCES ===\n")
 
-balances = [b for b in account['balances'] if float(b['free']) > 0 or float(b['locked']) > 0]
+# Parse free/locked once as arrays - most of the listed assets are empty
+all_balances = account['balances']
+free = np.fromiter((b['free'] for b in all_balances), dtype=np.float64, count=len(all_balances))
+locked = np.fromiter((b['locked'] for b in all_balances), dtype=np.float64, count=len(all_balances))
+held = np.nonzero((free + locked) > 0)[0]
 
-if balances:
-    for b in balances:
-        print(f"{b['asset']:8}  Free: {float(b['free']):12.4f}  Locked: {float(b['locked']):12.4f}")
+if held.size:
+    for i in held:
+        print(f"{all_balances[i]['asset']:8}  Free: {free[i]:12.4f}  Locked: {locked[i]:12.4f}")
 else:
     print("⚠️  No balances found!")
     print("\n📝 NOTE: Binance Testnet accounts automatically receive test funds upon registration.")
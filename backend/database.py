@@ -1,23 +1,69 @@
 # database.py
+from sqlalchemy import event
+from sqlalchemy.orm import sessionmaker
 from sqlmodel import SQLModel, create_engine, Session, select
 from dotenv import load_dotenv 
 import os
+from models import PortfolioAsset
 
 load_dotenv() 
 
 database_url = os.environ.get("DATABASE_URL", "sqlite:///./algoquant.db")
 
+# SQL statement logging is opt-in (SQL_ECHO=1) - it formats and writes every query
+sql_echo = os.environ.get("SQL_ECHO", "0") == "1"
+
+# psycopg 3 (postgresql+psycopg://) prepares a statement server-side once it has
+# run prepare_threshold times on a connection, letting Postgres skip parse/plan.
+# Set DB_PREPARE_THRESHOLD to tune it (lower = prepare sooner); leave it unset
+# behind transaction-mode PgBouncer, which can't keep prepared statements.
+connect_args = {}
+prepare_threshold = os.environ.get("DB_PREPARE_THRESHOLD")
+if prepare_threshold and database_url.startswith("postgresql+psycopg://"):
+    connect_args["prepare_threshold"] = int(prepare_threshold)
+
+is_sqlite = database_url.startswith("sqlite")
+if is_sqlite:
+    # Busy timeout: wait for a competing writer instead of failing with "database is locked"
+    connect_args["timeout"] = 30
+
 engine = create_engine(
     database_url, 
-    echo=True,
+    echo=sql_echo,
     pool_pre_ping=True,
-    pool_recycle=300,
-    pool_size=5,
-    max_overflow=10
+    pool_recycle=int(os.environ.get("DB_POOL_RECYCLE", "300")),
+    pool_size=int(os.environ.get("DB_POOL_SIZE", "5")),
+    max_overflow=int(os.environ.get("DB_MAX_OVERFLOW", "10")),
+    # LIFO checkout keeps reusing the most recently returned (warm) connections,
+    # so surplus ones sit idle and get recycled during quiet periods
+    pool_use_lifo=True,
+    # Room for every distinct statement shape the app compiles (default 500)
+    query_cache_size=1200,
+    connect_args=connect_args
 )
 
+if is_sqlite:
+    @event.listens_for(engine, "connect")
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        # WAL lets readers run alongside the bot threads' writes; with WAL,
+        # synchronous=NORMAL only fsyncs at checkpoints and is still crash-safe
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.close()
+
+# Session factory bound once to the shared engine. Objects stay readable after
+# commit (no re-SELECT to refresh them), and flushes happen at commit rather
+# than before every query.
+SessionLocal = sessionmaker(bind=engine, class_=Session, expire_on_commit=False, autoflush=False)
+
+
 def create_db_and_tables():
     SQLModel.metadata.create_all(engine)
+    # create_all() skips tables that already exist, so add newer indexes explicitly
+    for table in SQLModel.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(engine, checkfirst=True)
 
 
 def initialize_portfolio_if_empty(user_email: str = "default_user"):
@@ -25,9 +71,7 @@ def initialize_portfolio_if_empty(user_email: str = "default_user"):
     Initialize portfolio with 10,000 USDT only on first run.
     Persistent across restarts - won't reset if portfolio already exists.
     """
-    from models import PortfolioAsset
-    
-    with Session(engine) as session:
+    with SessionLocal() as session:
         # Check if this user has any portfolio assets
         statement = select(PortfolioAsset).where(PortfolioAsset.user_email == user_email)
         existing_assets = session.exec(statement).all()
@@ -45,6 +89,7 @@ def initialize_portfolio_if_empty(user_email: str = "default_user"):
             print("[Portfolio] ✅ Starting capital deposited: 10,000 USDT")
         else:
             total_assets = len(existing_assets)
-            print(f"[Portfolio] Loading existing portfolio for {user_email} ({total_assets} assets)")
-            for asset in existing_assets:
-                print(f"  - {asset.symbol}: {asset.balance:.8f}")
\ No newline at end of file
+            # Build the report up front and write it with a single print call
+            lines = [f"[Portfolio] Loading existing portfolio for {user_email} ({total_assets} assets)"]
+            lines.extend(f"  - {asset.symbol}: {asset.balance:.8f}" for asset in existing_assets)
+            print("\n".join(lines))
\ No newline at end of file
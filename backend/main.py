@@ -1,11 +1,17 @@
-from fastapi import FastAPI, HTTPException, Depends, status, Header
+from fastapi import FastAPI, HTTPException, Depends, status, Header, Response
 from contextlib import asynccontextmanager
+from functools import lru_cache
 from typing import Optional, Annotated
 from datetime import datetime, timedelta
+import asyncio
+import json
+import logging
+import logging.handlers
+import queue
 
 # SQLModel & Database Imports
 from sqlmodel import Session, select
-from database import create_db_and_tables, engine
+from database import create_db_and_tables, SessionLocal
 from models import User 
 
 # Security Imports
@@ -27,18 +33,38 @@ from model_manager import (
     get_cached_models
 )
 
+# --- LOGGING ---
+# Module loggers enqueue records; a background listener thread does the actual
+# stdout writes, so trading threads never block on console I/O
+log_queue = queue.SimpleQueue()
+log_listener = logging.handlers.QueueListener(
+    log_queue,
+    logging.StreamHandler(),
+    respect_handler_level=True
+)
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s %(levelname)s [%(name)s] %(message)s",
+    handlers=[logging.handlers.QueueHandler(log_queue)]
+)
+
 # --- 1. LIFESPAN (Create Tables on Startup) ---
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    create_db_and_tables()
-    # Load all pre-trained HMM-SVR models from disk into memory
+    log_listener.start()
     print("\n🚀 Starting AlgoQuant API...")
-    loaded_models = load_all_models()
+    # Table setup (DB round-trips) and loading the pre-trained HMM-SVR models
+    # from disk (unpickling) are independent - run them side by side
+    _, loaded_models = await asyncio.gather(
+        asyncio.to_thread(create_db_and_tables),
+        asyncio.to_thread(load_all_models)
+    )
     if loaded_models:
         print(f"✅ Loaded {len(loaded_models)} HMM-SVR models: {list(loaded_models.keys())}")
     else:
         print("ℹ️  No pre-trained models found. Train models using /api/models/train/{symbol}")
     yield
+    log_listener.stop()
 
 app = FastAPI(lifespan=lifespan)
 
@@ -91,6 +117,10 @@ class BacktestRequest(BaseModel):
     long_window: int = 26
     n_states: int = 3
 
+# Strategies the backtest endpoint can run - all map to the HMM-SVR walk-forward
+# backtest ("hmm" is the id the backtest page sends)
+BACKTEST_STRATEGIES = frozenset({"hmm", "hmm_svr"})
+
 class Token(BaseModel):
     access_token: str
     token_type: str
@@ -103,7 +133,7 @@ class SimulatedTradingRequest(BaseModel):
 
 # --- DATABASE DEPENDENCY ---
 def get_session():
-    with Session(engine) as session:
+    with SessionLocal() as session:
         yield session
 
 # --- AUTH HELPERS ---
@@ -208,6 +238,12 @@ def run_backtest(
     req: BacktestRequest, 
     current_user: str = Depends(get_current_user)
 ):
+    # Reject unsupported strategies before downloading data / training models.
+    # Returned as an error payload (like train_models_and_backtest's own errors)
+    # so the backtest page shows the message instead of a generic failure
+    if req.strategy not in BACKTEST_STRATEGIES:
+        return {"error": f"Unknown strategy: {req.strategy}"}
+    
     print(f"User {current_user} is running {req.strategy} backtest...")
     
     result = train_models_and_backtest(
@@ -330,9 +366,8 @@ def get_instant_signal(symbol: str, current_user: str = Depends(get_current_user
     
     Example: GET /api/models/signal/BTCUSDT
     """
-    from model_manager import is_model_trained, load_model, calculate_signal_and_position, train_and_save_model
-    import yfinance as yf
-    from datetime import datetime, timedelta
+    from model_manager import is_model_trained, load_model, calculate_signal_and_position, ensure_model_trained
+    from strategy_handlers import get_daily_closes
     import pandas as pd
     
     symbol = symbol.upper()
@@ -346,14 +381,17 @@ def get_instant_signal(symbol: str, current_user: str = Depends(get_current_user
         try:
             # Train model with both Yahoo symbol and Binance symbol for fallback
             # Save model with base symbol name (BNB) not Yahoo format (BNB-USD)
-            train_result = train_and_save_model(
+            # (None = a concurrent request finished training it while we waited)
+            train_result = ensure_model_trained(
                 symbol=yahoo_symbol, 
                 n_states=3, 
                 binance_symbol=symbol,
                 save_as=base_symbol
             )
             
-            if train_result and 'error' not in train_result:
+            if train_result is None:
+                print(f"[SignalAPI] ✅ Model for {base_symbol} was trained by a concurrent request")
+            elif 'error' not in train_result:
                 print(f"[SignalAPI] ✅ Model trained for {base_symbol} with {train_result.get('train_days', 0)} days")
             else:
                 return {
@@ -367,25 +405,18 @@ def get_instant_signal(symbol: str, current_user: str = Depends(get_current_user
                 "error": f"Model training failed: {str(e)}"
             }
     
-    # Fetch recent price data (450 days for proper feature calculation)
+    # Recent daily closes from the shared history cache - the same series the
+    # bot sessions use, so repeat signal requests don't re-download 450 days
     try:
-        end_date = datetime.now()
-        start_date = end_date - timedelta(days=450)
-        
-        df = yf.download(yahoo_symbol, start=start_date, end=end_date, progress=False, auto_adjust=True)
+        closes = get_daily_closes(yahoo_symbol)
         
-        if df.empty:
+        if len(closes) == 0:
             return {
                 "success": False,
                 "error": f"Could not fetch price data for {yahoo_symbol}"
             }
         
-        # Handle MultiIndex columns
-        if isinstance(df.columns, pd.MultiIndex):
-            if 'Close' in df.columns.get_level_values(0):
-                df.columns = df.columns.get_level_values(0)
-            else:
-                df.columns = df.columns.get_level_values(1)
+        df = pd.DataFrame({'Close': closes})
         
         # Get signal from model (use base_symbol for model lookup, yahoo_symbol for data)
         result = calculate_signal_and_position(
@@ -479,18 +510,22 @@ def get_instant_signal(symbol: str, current_user: str = Depends(get_current_user
 @app.get("/api/simulated/trades")
 def get_simulated_trades(
     limit: int = 50,
-    current_user: str = Depends(get_current_user)
+    current_user: str = Depends(get_current_user),
+    session: Session = Depends(get_session)
 ):
     """Get recent simulated trades for the current user"""
     from simulated_endpoints import get_simulated_trades_endpoint
-    return get_simulated_trades_endpoint(limit, current_user)
+    return get_simulated_trades_endpoint(session, limit, current_user)
 
 
 @app.get("/api/simulated/sessions")
-def get_simulated_sessions(current_user: str = Depends(get_current_user)):
+def get_simulated_sessions(
+    current_user: str = Depends(get_current_user),
+    session: Session = Depends(get_session)
+):
     """Get all simulated trading sessions for the current user"""
     from simulated_endpoints import get_simulated_sessions_endpoint
-    return get_simulated_sessions_endpoint(current_user)
+    return get_simulated_sessions_endpoint(session, current_user)
 
 
 @app.get("/api/simulated/portfolio")
@@ -555,6 +590,26 @@ def get_simulated_session(session_id: str, current_user: str = Depends(get_curre
 
 # --- MANUAL TRADING ROUTES (Market Page) ---
 
+# Display metadata for the Market page (static - built once at import)
+MARKET_ASSETS = (
+    {"symbol": "BTC", "name": "Bitcoin", "logo": "₿", "color": "#F7931A"},
+    {"symbol": "ETH", "name": "Ethereum", "logo": "Ξ", "color": "#627EEA"},
+    {"symbol": "SOL", "name": "Solana", "logo": "◎", "color": "#14F195"},
+    {"symbol": "LINK", "name": "Chainlink", "logo": "⬡", "color": "#2A5ADA"},
+    {"symbol": "DOGE", "name": "Dogecoin", "logo": "Ð", "color": "#C2A633"},
+    {"symbol": "BNB", "name": "BNB", "logo": "⬡", "color": "#F3BA2F"},
+)
+
+
+@lru_cache(maxsize=1)
+def _market_assets_json() -> bytes:
+    """Encode the static /api/market/assets payload once; later requests reuse the bytes"""
+    from manual_trading import SUPPORTED_ASSETS
+    
+    assets = [a for a in MARKET_ASSETS if a["symbol"] in SUPPORTED_ASSETS]
+    # Same encoding FastAPI's JSONResponse would produce
+    return json.dumps({"assets": assets}, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
 class ManualBuyRequest(BaseModel):
     symbol: str  # e.g., 'BTC', 'ETH'
     usdt_amount: float  # Amount in USDT to spend
@@ -701,18 +756,7 @@ def get_market_prices(current_user: str = Depends(get_current_user)):
 @app.get("/api/market/assets")
 def get_supported_assets(current_user: str = Depends(get_current_user)):
     """Get list of supported assets for manual trading"""
-    from manual_trading import SUPPORTED_ASSETS
-    
-    assets = [
-        {"symbol": "BTC", "name": "Bitcoin", "logo": "₿", "color": "#F7931A"},
-        {"symbol": "ETH", "name": "Ethereum", "logo": "Ξ", "color": "#627EEA"},
-        {"symbol": "SOL", "name": "Solana", "logo": "◎", "color": "#14F195"},
-        {"symbol": "LINK", "name": "Chainlink", "logo": "⬡", "color": "#2A5ADA"},
-        {"symbol": "DOGE", "name": "Dogecoin", "logo": "Ð", "color": "#C2A633"},
-        {"symbol": "BNB", "name": "BNB", "logo": "⬡", "color": "#F3BA2F"},
-    ]
-    
-    return {"assets": [a for a in assets if a["symbol"] in SUPPORTED_ASSETS]}
+    return Response(content=_market_assets_json(), media_type="application/json")
 
 
 @app.get("/api/market/cost-basis/{symbol}")
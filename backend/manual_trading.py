@@ -3,23 +3,54 @@ Manual Trading Service
 Handles manual buy/sell operations for the Market page
 Operates independently from automated trading bot strategies
 """
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional, Tuple, List
 from datetime import datetime
+from sqlalchemy import and_, bindparam, case
 from sqlmodel import Session, select
-from database import engine
+from database import SessionLocal
 from models import PortfolioAsset, Trade
+from simulated_exchange import BALANCE_BY_SYMBOL, get_current_price, get_prices
+import logging
+import threading
+import time
 import uuid
 
+log = logging.getLogger(__name__)
+
 # Trading fee (0.1% as typical exchange fee)
 TRADING_FEE = 0.001
 
 # Supported trading pairs for manual trading
 SUPPORTED_ASSETS = ["BTC", "ETH", "SOL", "LINK", "DOGE", "BNB"]
 
+# Short-lived cache for get_prices_for_assets - concurrent page loads share one
+# round of ticker requests instead of each hitting Binance per asset
+PRICES_CACHE_TTL_SECONDS = 0.5
+_prices_cache = {}  # tuple(assets) -> (fetched_at, prices)
+_prices_cache_lock = threading.Lock()
+
+# USDT + traded asset rows for one user (see _load_trade_rows), built once
+_TRADE_ROWS = select(PortfolioAsset).where(
+    PortfolioAsset.user_email == bindparam("user_email"),
+    PortfolioAsset.symbol.in_(bindparam("symbols", expanding=True))
+)
+
+# Just the columns get_asset_cost_basis returns
+_COST_BASIS_BY_SYMBOL = select(
+    PortfolioAsset.balance, PortfolioAsset.avg_cost_basis, PortfolioAsset.total_invested
+).where(
+    PortfolioAsset.symbol == bindparam("symbol"),
+    PortfolioAsset.user_email == bindparam("user_email")
+)
+
 
 def get_current_price_from_binance(symbol: str, quote: str = "USDT") -> Optional[float]:
     """
-    Fetch current market price from Binance API
+    Fetch current market price from Binance API (Yahoo Finance fallback)
+    
+    Goes through the exchange's shared short-lived price cache, so a trade
+    right after a page load (or a batch get_prices call) reuses that price.
     
     Args:
         symbol: Base asset (e.g., 'BTC', 'ETH')
@@ -28,36 +59,7 @@ def get_current_price_from_binance(symbol: str, quote: str = "USDT") -> Optional
     Returns:
         Current price or None if error
     """
-    try:
-        from binance.client import Client
-        import os
-        from dotenv import load_dotenv
-        
-        load_dotenv()
-        
-        api_key = os.getenv("BINANCE_API_KEY", "")
-        api_secret = os.getenv("BINANCE_SECRET_KEY", "")
-        
-        client = Client(api_key, api_secret, testnet=True)
-        trading_pair = f"{symbol}{quote}"
-        ticker = client.get_symbol_ticker(symbol=trading_pair)
-        return float(ticker['price'])
-    except Exception as e:
-        print(f"[ManualTrading] Binance fetch failed for {symbol}/{quote}: {e}")
-        
-        # Fallback to Yahoo Finance
-        try:
-            import yfinance as yf
-            ticker_symbol = f"{symbol}-USD"
-            ticker = yf.Ticker(ticker_symbol)
-            price_data = ticker.history(period="1d", interval="1m")
-            
-            if not price_data.empty:
-                return float(price_data['Close'].iloc[-1])
-            return None
-        except Exception as yf_error:
-            print(f"[ManualTrading] Yahoo Finance fallback failed: {yf_error}")
-            return None
+    return get_current_price(symbol, quote)
 
 
 def get_user_balance(symbol: str, user_email: str) -> float:
@@ -71,13 +73,10 @@ def get_user_balance(symbol: str, user_email: str) -> float:
     Returns:
         Current balance (0.0 if asset not found)
     """
-    with Session(engine) as session:
-        statement = select(PortfolioAsset).where(
-            PortfolioAsset.symbol == symbol,
-            PortfolioAsset.user_email == user_email
-        )
-        asset = session.exec(statement).first()
-        return asset.balance if asset else 0.0
+    with SessionLocal() as session:
+        # Single-column select - a plain float, no PortfolioAsset object to build
+        balance = session.exec(BALANCE_BY_SYMBOL, params={"symbol": symbol, "user_email": user_email}).first()
+        return balance if balance is not None else 0.0
 
 
 def get_asset_cost_basis(symbol: str, user_email: str) -> dict:
@@ -91,19 +90,17 @@ def get_asset_cost_basis(symbol: str, user_email: str) -> dict:
     Returns:
         Dict with avg_cost_basis, total_invested, and balance
     """
-    with Session(engine) as session:
-        statement = select(PortfolioAsset).where(
-            PortfolioAsset.symbol == symbol,
-            PortfolioAsset.user_email == user_email
-        )
-        asset = session.exec(statement).first()
+    with SessionLocal() as session:
+        asset = session.exec(
+            _COST_BASIS_BY_SYMBOL, params={"symbol": symbol, "user_email": user_email}
+        ).first()
         
         if asset:
             return {
                 'symbol': symbol,
                 'balance': asset.balance,
-                'avg_cost_basis': getattr(asset, 'avg_cost_basis', 0.0) or 0.0,
-                'total_invested': getattr(asset, 'total_invested', 0.0) or 0.0
+                'avg_cost_basis': asset.avg_cost_basis or 0.0,
+                'total_invested': asset.total_invested or 0.0
             }
         return {
             'symbol': symbol,
@@ -157,6 +154,20 @@ def record_trade(
     return trade
 
 
+def _load_trade_rows(session: Session, symbol: str, user_email: str) -> Tuple[Optional[PortfolioAsset], Optional[PortfolioAsset]]:
+    """
+    Load the user's USDT and asset rows for a trade with a single query
+    
+    Returns:
+        Tuple of (usdt_asset, asset) - either may be None if not held yet
+    """
+    holdings = {
+        row.symbol: row
+        for row in session.exec(_TRADE_ROWS, params={"user_email": user_email, "symbols": ["USDT", symbol]})
+    }
+    return holdings.get("USDT"), holdings.get(symbol)
+
+
 def execute_manual_buy(
     symbol: str,
     usdt_amount: float,
@@ -191,31 +202,21 @@ def execute_manual_buy(
     usdt_after_fee = usdt_amount - fee
     quantity_to_buy = usdt_after_fee / price
     
-    # Check if user has enough USDT
-    usdt_balance = get_user_balance("USDT", user_email)
-    
-    if usdt_balance < usdt_amount:
-        return False, None, f"Insufficient USDT balance. Required: {usdt_amount:.2f}, Available: {usdt_balance:.2f}"
-    
     # Execute trade in database transaction
     try:
-        with Session(engine) as session:
+        with SessionLocal() as session:
+            usdt_asset, asset = _load_trade_rows(session, symbol, user_email)
+            
+            # Check if user has enough USDT
+            usdt_balance = usdt_asset.balance if usdt_asset else 0.0
+            if usdt_balance < usdt_amount:
+                return False, None, f"Insufficient USDT balance. Required: {usdt_amount:.2f}, Available: {usdt_balance:.2f}"
+            
             # Deduct USDT
-            usdt_stmt = select(PortfolioAsset).where(
-                PortfolioAsset.symbol == "USDT",
-                PortfolioAsset.user_email == user_email
-            )
-            usdt_asset = session.exec(usdt_stmt).first()
             usdt_asset.balance -= usdt_amount
             session.add(usdt_asset)
             
             # Add purchased asset and update cost basis
-            asset_stmt = select(PortfolioAsset).where(
-                PortfolioAsset.symbol == symbol,
-                PortfolioAsset.user_email == user_email
-            )
-            asset = session.exec(asset_stmt).first()
-            
             if asset:
                 # Calculate new weighted average cost basis
                 old_balance = asset.balance
@@ -251,8 +252,6 @@ def execute_manual_buy(
                 fee=fee
             )
             
-            session.commit()
-            
             trade_info = {
                 'order_id': trade.order_id,
                 'symbol': f"{symbol}USDT",
@@ -269,13 +268,15 @@ def execute_manual_buy(
                 }
             }
             
+            session.commit()
+            
             print(f"[ManualTrading] ✅ BUY executed: {quantity_to_buy:.8f} {symbol} @ ${price:.2f}")
             print(f"  Spent: ${usdt_amount:.2f} USDT (Fee: ${fee:.4f})")
             
             return True, trade_info, None
             
     except Exception as e:
-        print(f"[ManualTrading] ❌ BUY transaction failed: {e}")
+        log.exception("Manual BUY transaction failed for %s", symbol)
         return False, None, f"Transaction failed: {str(e)}"
 
 
@@ -308,12 +309,6 @@ def execute_manual_sell(
     if price is None:
         return False, None, f"Could not fetch price for {symbol}/USDT"
     
-    # Check if user has enough of the asset to sell
-    asset_balance = get_user_balance(symbol, user_email)
-    
-    if asset_balance < quantity:
-        return False, None, f"Insufficient {symbol} balance. Required: {quantity:.8f}, Available: {asset_balance:.8f}"
-    
     # Calculate proceeds after fee
     gross_proceeds = price * quantity
     fee = gross_proceeds * TRADING_FEE
@@ -321,14 +316,15 @@ def execute_manual_sell(
     
     # Execute trade in database transaction
     try:
-        with Session(engine) as session:
-            # Deduct sold asset and calculate PnL
-            asset_stmt = select(PortfolioAsset).where(
-                PortfolioAsset.symbol == symbol,
-                PortfolioAsset.user_email == user_email
-            )
-            asset = session.exec(asset_stmt).first()
+        with SessionLocal() as session:
+            usdt_asset, asset = _load_trade_rows(session, symbol, user_email)
+            
+            # Check if user has enough of the asset to sell
+            asset_balance = asset.balance if asset else 0.0
+            if asset_balance < quantity:
+                return False, None, f"Insufficient {symbol} balance. Required: {quantity:.8f}, Available: {asset_balance:.8f}"
             
+            # Deduct sold asset and calculate PnL
             # Calculate PnL based on cost basis
             avg_cost_basis = getattr(asset, 'avg_cost_basis', 0.0) or 0.0
             total_invested = getattr(asset, 'total_invested', 0.0) or 0.0
@@ -356,12 +352,6 @@ def execute_manual_sell(
             session.add(asset)
             
             # Add USDT proceeds
-            usdt_stmt = select(PortfolioAsset).where(
-                PortfolioAsset.symbol == "USDT",
-                PortfolioAsset.user_email == user_email
-            )
-            usdt_asset = session.exec(usdt_stmt).first()
-            
             if usdt_asset:
                 usdt_asset.balance += net_proceeds
                 session.add(usdt_asset)
@@ -386,8 +376,6 @@ def execute_manual_sell(
                 pnl=pnl
             )
             
-            session.commit()
-            
             trade_info = {
                 'order_id': trade.order_id,
                 'symbol': f"{symbol}USDT",
@@ -408,6 +396,8 @@ def execute_manual_sell(
                 }
             }
             
+            session.commit()
+            
             pnl_emoji = "📈" if pnl >= 0 else "📉"
             print(f"[ManualTrading] ✅ SELL executed: {quantity:.8f} {symbol} @ ${price:.2f}")
             print(f"  Received: ${net_proceeds:.2f} USDT (Fee: ${fee:.4f})")
@@ -416,7 +406,7 @@ def execute_manual_sell(
             return True, trade_info, None
             
     except Exception as e:
-        print(f"[ManualTrading] ❌ SELL transaction failed: {e}")
+        log.exception("Manual SELL transaction failed for %s", symbol)
         return False, None, f"Transaction failed: {str(e)}"
 
 
@@ -431,38 +421,46 @@ def get_manual_trade_history(user_email: str, limit: int = 50) -> List[dict]:
     Returns:
         List of trade dictionaries
     """
-    with Session(engine) as session:
-        statement = select(Trade).where(
+    # pnl_percent for sell trades is computed by the database:
+    # cost_basis = total - pnl (what we got minus profit = what we paid)
+    cost_basis = Trade.total - Trade.pnl
+    pnl_percent = case(
+        (and_(Trade.side == "SELL", Trade.pnl.isnot(None), cost_basis > 0),
+         Trade.pnl / cost_basis * 100),
+        else_=None
+    ).label("pnl_percent")
+    
+    with SessionLocal() as session:
+        # Column projection: rows come back as lightweight tuples, not ORM entities
+        statement = select(
+            Trade.id, Trade.order_id, Trade.symbol, Trade.side, Trade.price,
+            Trade.quantity, Trade.total, Trade.pnl, Trade.executed_at, pnl_percent
+        ).where(
             Trade.user_email == user_email,
-            Trade.session_id.startswith("manual_")
+            # Literal pattern with "_" escaped: startswith() would send
+            # LIKE :p || '%' (unescaped "_" wildcard, opaque to the planner)
+            Trade.session_id.like("manual\\_%", escape="\\")
         ).order_by(Trade.executed_at.desc()).limit(limit)
-        
-        trades = session.exec(statement).all()
-        
-        result = []
-        for trade in trades:
-            # Calculate pnl_percent for sell trades
-            pnl_percent = None
-            if trade.side == "SELL" and trade.pnl is not None:
-                # cost_basis = total - pnl (what we got minus profit = what we paid)
-                cost_basis = trade.total - trade.pnl
-                if cost_basis > 0:
-                    pnl_percent = (trade.pnl / cost_basis) * 100
-            
-            result.append({
-                'id': trade.id,
-                'order_id': trade.order_id,
-                'symbol': trade.symbol,
-                'side': trade.side,
-                'price': trade.price,
-                'quantity': trade.quantity,
-                'total': trade.total,
-                'pnl': trade.pnl,
-                'pnl_percent': pnl_percent,
-                'time': trade.executed_at.isoformat() if trade.executed_at else None
-            })
-        
-        return result
+        rows = session.exec(statement).all()
+    
+    # Session is closed - build the response without holding a connection
+    result = [
+        {
+            'id': trade.id,
+            'order_id': trade.order_id,
+            'symbol': trade.symbol,
+            'side': trade.side,
+            'price': trade.price,
+            'quantity': trade.quantity,
+            'total': trade.total,
+            'pnl': trade.pnl,
+            'pnl_percent': trade.pnl_percent,
+            'time': trade.executed_at.isoformat() if trade.executed_at else None
+        }
+        for trade in rows
+    ]
+    
+    return result
 
 
 def get_prices_for_assets(assets: List[str] = None) -> dict:
@@ -478,9 +476,42 @@ def get_prices_for_assets(assets: List[str] = None) -> dict:
     if assets is None:
         assets = SUPPORTED_ASSETS
     
+    cache_key = tuple(assets)
+    cached = _prices_cache.get(cache_key)
+    if cached and time.monotonic() - cached[0] < PRICES_CACHE_TTL_SECONDS:
+        return dict(cached[1])
+    
+    # Only one thread refreshes per TTL window; the others wait and reuse its result
+    with _prices_cache_lock:
+        cached = _prices_cache.get(cache_key)
+        if cached and time.monotonic() - cached[0] < PRICES_CACHE_TTL_SECONDS:
+            return dict(cached[1])
+        
+        prices = _fetch_prices(assets)
+        _prices_cache[cache_key] = (time.monotonic(), prices)
+        return dict(prices)
+
+
+def _fetch_prices(assets: List[str]) -> dict:
+    """Fetch prices for the given assets from Binance (uncached)"""
+    if not assets:
+        return {}
+    
+    # One multi-symbol ticker request covers every listed pair
+    batch_prices = get_prices(assets, "USDT")
+    
+    # Anything the batch missed goes through the per-asset path (with its Yahoo
+    # fallback). Those lookups are independent network calls - run them
+    # concurrently over the shared client's connection pool
+    missing = [asset for asset in assets if asset not in batch_prices]
+    if missing:
+        with ThreadPoolExecutor(max_workers=min(len(missing), 8)) as executor:
+            fetched = executor.map(lambda asset: get_current_price_from_binance(asset, "USDT"), missing)
+            batch_prices.update(zip(missing, fetched))
+    
     prices = {}
     for asset in assets:
-        price = get_current_price_from_binance(asset, "USDT")
+        price = batch_prices.get(asset)
         if price:
             prices[asset] = {
                 'symbol': asset,
@@ -3,12 +3,16 @@ Model Manager for HMM-SVR Trading Models
 Handles training, saving, loading, and prediction for live trading.
 Models are persisted to disk for Hugging Face Spaces cold start handling.
 """
+import logging
 import os
+import threading
 import joblib
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import pandas as pd
 import yfinance as yf
 from datetime import datetime, timedelta
+from functools import lru_cache
 from typing import Optional, Dict, Tuple, Any
 from hmmlearn.hmm import GaussianHMM
 from sklearn.svm import SVR
@@ -18,6 +22,8 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
+log = logging.getLogger(__name__)
+
 # Directory for storing trained models
 MODEL_DIR = os.path.join(os.path.dirname(__file__), 'models')
 os.makedirs(MODEL_DIR, exist_ok=True)
@@ -25,6 +31,11 @@ os.makedirs(MODEL_DIR, exist_ok=True)
 # Global cache for loaded models (survives until Space sleeps)
 _model_cache: Dict[str, Dict[str, Any]] = {}
 
+# Per-symbol training locks - concurrent sessions/requests for an untrained
+# symbol wait for one training run instead of each fitting their own
+_training_locks: Dict[str, threading.Lock] = {}
+_training_locks_guard = threading.Lock()
+
 
 def get_model_path(symbol: str) -> str:
     """Get the file path for a symbol's model."""
@@ -39,12 +50,16 @@ def is_model_trained(symbol: str) -> bool:
 
 def get_model_info(symbol: str) -> Optional[Dict]:
     """Get metadata about a trained model."""
-    model_path = get_model_path(symbol)
-    if not os.path.exists(model_path):
-        return None
+    # Reuse the in-memory model when available instead of unpickling it again
+    model_data = _model_cache.get(symbol.upper())
+    if model_data is None:
+        model_path = get_model_path(symbol)
+        if not os.path.exists(model_path):
+            return None
     
     try:
-        model_data = joblib.load(model_path)
+        if model_data is None:
+            model_data = joblib.load(model_path)
         return {
             'symbol': symbol,
             'trained_at': model_data.get('trained_at', 'Unknown'),
@@ -52,8 +67,8 @@ def get_model_info(symbol: str) -> Optional[Dict]:
             'avg_train_vol': model_data.get('avg_train_vol', 0),
             'train_days': model_data.get('train_days', 0),
         }
-    except Exception as e:
-        print(f"[ModelManager] Error reading model info for {symbol}: {e}")
+    except Exception:
+        log.exception("Error reading model info for %s", symbol)
         return None
 
 
@@ -71,7 +86,7 @@ def fetch_training_data_yfinance(ticker: str, years: int = 4) -> Optional[pd.Dat
     print(f"[ModelManager] Fetching {years} years of data for {yahoo_ticker}...")
     
     try:
-        df = yf.download(yahoo_ticker, start=start_date, end=end_date, progress=False, auto_adjust=True)
+        df = yf.download(yahoo_ticker, start=start_date, end=end_date, progress=False, auto_adjust=True, threads=False)
         
         if df.empty:
             print(f"[ModelManager] No data returned for {yahoo_ticker}")
@@ -85,19 +100,31 @@ def fetch_training_data_yfinance(ticker: str, years: int = 4) -> Optional[pd.Dat
                 df.columns = df.columns.get_level_values(1)
         
         print(f"[ModelManager] Fetched {len(df)} days of data")
-        return df.dropna()
-    except Exception as e:
-        print(f"[ModelManager] Error fetching data: {e}")
+        # Features are derived from Close only - drop the other OHLCV columns
+        return df[['Close']].dropna()
+    except Exception:
+        log.exception("Error fetching data for %s", yahoo_ticker)
         return None
 
 
+@lru_cache(maxsize=1)
+def get_public_binance_client() -> Client:
+    """
+    Shared unauthenticated Binance client for public market data.
+    Built once so training runs reuse its keep-alive HTTPS session.
+    """
+    client = Client()  # No API keys needed for public data
+    client.session.headers.update({'User-Agent': 'algoquant'})
+    return client
+
+
 def fetch_training_data_binance(symbol: str, days: int = 1460) -> Optional[pd.DataFrame]:
     """
     Fetch historical daily data from Binance for training.
     Falls back to this if yfinance fails.
     """
     try:
-        client = Client()  # No API keys needed for public data
+        client = get_public_binance_client()
         
         # Calculate start time
         end_time = datetime.now()
@@ -116,24 +143,18 @@ def fetch_training_data_binance(symbol: str, days: int = 1460) -> Optional[pd.Da
             print(f"[ModelManager] No Binance data returned for {symbol}")
             return None
         
-        df = pd.DataFrame(klines, columns=[
-            'timestamp', 'Open', 'High', 'Low', 'Close', 'Volume',
-            'close_time', 'quote_volume', 'trades', 'taker_buy_base',
-            'taker_buy_quote', 'ignore'
-        ])
+        # Kline rows are [open_time, open, high, low, close, volume, ...] with prices
+        # as strings. Features are derived from Close only, so parse just that
+        # column (one float64 cast) and skip the other eleven fields
+        closes = np.fromiter((k[4] for k in klines), dtype=np.float64, count=len(klines))
+        timestamps = pd.to_datetime(np.fromiter((k[0] for k in klines), dtype=np.int64, count=len(klines)), unit='ms')
         
-        df['timestamp'] = pd.to_datetime(df['timestamp'], unit='ms')
-        df.set_index('timestamp', inplace=True)
-        df['Close'] = df['Close'].astype(float)
-        df['Open'] = df['Open'].astype(float)
-        df['High'] = df['High'].astype(float)
-        df['Low'] = df['Low'].astype(float)
-        df['Volume'] = df['Volume'].astype(float)
+        df = pd.DataFrame({'Close': closes}, index=pd.Index(timestamps, name='timestamp'))
         
         print(f"[ModelManager] Fetched {len(df)} days from Binance")
-        return df[['Open', 'High', 'Low', 'Close', 'Volume']].dropna()
-    except Exception as e:
-        print(f"[ModelManager] Error fetching Binance data: {e}")
+        return df.dropna()
+    except Exception:
+        log.exception("Error fetching Binance data for %s", symbol)
         return None
 
 
@@ -150,7 +171,7 @@ def engineer_features(df: pd.DataFrame) -> pd.DataFrame:
     df['Volatility'] = df['Log_Returns'].rolling(window=10).std()
     
     # Downside volatility (std of negative returns only)
-    df['Downside_Returns'] = df['Log_Returns'].apply(lambda x: x if x < 0 else 0)
+    df['Downside_Returns'] = df['Log_Returns'].where(df['Log_Returns'] < 0, 0)
     df['Downside_Vol'] = df['Downside_Returns'].rolling(10).std()
     
     # Target for SVR: next day's volatility
@@ -167,7 +188,7 @@ def train_hmm_model(train_df: pd.DataFrame, n_states: int = 3) -> Tuple[Gaussian
     """
     X_train = train_df[['Log_Returns', 'Volatility']].values * 100
     
-    model = GaussianHMM(n_components=n_states, covariance_type="full", n_iter=100, random_state=42)
+    model = GaussianHMM(n_components=n_states, covariance_type="diag", n_iter=100, random_state=42)
     model.fit(X_train)
     
     # Calculate average volatility per state
@@ -254,7 +275,8 @@ def train_and_save_model(symbol: str, n_states: int = 3, binance_symbol: str = N
     # Apply regime labels to training data
     X_train = df[['Log_Returns', 'Volatility']].values * 100
     raw_states = hmm_model.predict(X_train)
-    df['Regime'] = [state_mapping[s] for s in raw_states]
+    regime_lookup = np.array([state_mapping[s] for s in range(n_states)])
+    df['Regime'] = regime_lookup[raw_states]
     
     # Calculate average training volatility for risk ratio
     avg_train_vol = df['Volatility'].mean()
@@ -298,6 +320,27 @@ def train_and_save_model(symbol: str, n_states: int = 3, binance_symbol: str = N
     }
 
 
+def ensure_model_trained(symbol: str, n_states: int = 3, binance_symbol: str = None, save_as: str = None) -> Optional[Dict[str, Any]]:
+    """
+    Train and save a model for a symbol only if none exists yet.
+    Takes the same arguments as train_and_save_model().
+    
+    Returns:
+        Training results, or None if a model was already available
+        (including one trained by a concurrent caller while we waited).
+    """
+    if save_as is None:
+        save_as = symbol.replace('USDT', '').replace('-USD', '')
+    
+    with _training_locks_guard:
+        lock = _training_locks.setdefault(save_as.upper(), threading.Lock())
+    
+    with lock:
+        if is_model_trained(save_as):
+            return None
+        return train_and_save_model(symbol, n_states=n_states, binance_symbol=binance_symbol, save_as=save_as)
+
+
 def load_model(symbol: str) -> Optional[Dict[str, Any]]:
     """
     Load a trained model from disk into memory.
@@ -322,8 +365,8 @@ def load_model(symbol: str) -> Optional[Dict[str, Any]]:
         _model_cache[symbol_upper] = model_data
         print(f"[ModelManager] ✅ Model loaded for {symbol}")
         return model_data
-    except Exception as e:
-        print(f"[ModelManager] Error loading model: {e}")
+    except Exception:
+        log.exception("Error loading model for %s", symbol)
         return None
 
 
@@ -339,16 +382,50 @@ def load_all_models() -> Dict[str, bool]:
         print("[ModelManager] No models directory found")
         return results
     
-    for filename in os.listdir(MODEL_DIR):
-        if filename.endswith('_hmm_svr.pkl'):
-            symbol = filename.replace('_hmm_svr.pkl', '').upper()
-            model = load_model(symbol)
-            results[symbol] = model is not None
+    symbols = [filename.replace('_hmm_svr.pkl', '').upper()
+               for filename in os.listdir(MODEL_DIR) if filename.endswith('_hmm_svr.pkl')]
+    
+    # Load the pickles concurrently - only the raw file reads release the GIL
+    # and overlap; unpickling the sklearn/hmmlearn objects still runs one at a time
+    if symbols:
+        with ThreadPoolExecutor(max_workers=min(len(symbols), 8)) as executor:
+            for symbol, model in zip(symbols, executor.map(load_model, symbols)):
+                results[symbol] = model is not None
     
     print(f"[ModelManager] Loaded {sum(results.values())} models: {list(results.keys())}")
     return results
 
 
+def _live_features(closes: np.ndarray, window: int = 10) -> Tuple[np.ndarray, ...]:
+    """
+    NumPy version of engineer_features() for prediction on a plain close array.
+    
+    Returns (closes, log_returns, volatility, downside_vol) aligned on the rows
+    engineer_features() keeps after dropna(): the first `window` rows lack a full
+    volatility window and the last row lacks a next-day target.
+    """
+    closes = closes[~np.isnan(closes)]
+    if len(closes) < window + 2:
+        empty = closes[:0]
+        return empty, empty, empty, empty
+    
+    log_returns = np.log(closes[1:] / closes[:-1])
+    downside = np.minimum(log_returns, 0.0)
+    
+    # Rolling sample std (ddof=1, as pandas) over each window of log returns;
+    # window k ends at close index k + window
+    volatility = np.lib.stride_tricks.sliding_window_view(log_returns, window).std(axis=1, ddof=1)
+    downside_vol = np.lib.stride_tricks.sliding_window_view(downside, window).std(axis=1, ddof=1)
+    
+    # Keep close indices window .. n-2
+    return (
+        closes[window:-1],
+        log_returns[window - 1:-1],
+        volatility[:-1],
+        downside_vol[:-1],
+    )
+
+
 def predict_regime_and_volatility(
     symbol: str,
     recent_data: pd.DataFrame
@@ -374,29 +451,31 @@ def predict_regime_and_volatility(
     avg_train_vol = model_data['avg_train_vol']
     n_states = model_data['n_states']
     
-    # Engineer features on recent data
-    df = engineer_features(recent_data)
+    # Engineer features on recent data (same rows engineer_features would keep)
+    closes, log_returns, volatility, downside_vol = _live_features(
+        recent_data['Close'].to_numpy(dtype=np.float64)
+    )
     
-    if len(df) < 20:
+    if len(closes) < 20:
         return {"error": "Insufficient recent data for prediction"}
     
     # Predict regime using HMM on recent window
-    lookback = min(252, len(df))  # Use up to 1 year of data
-    recent_window = df.iloc[-lookback:]
+    lookback = min(252, len(closes))  # Use up to 1 year of data
     
-    X_hmm = recent_window[['Log_Returns', 'Volatility']].values * 100
+    X_hmm = np.column_stack([log_returns[-lookback:], volatility[-lookback:]]) * 100
     hidden_states = hmm_model.predict(X_hmm)
     current_state_raw = hidden_states[-1]
     current_regime = state_mapping.get(current_state_raw, current_state_raw)
     
     # Get latest row for SVR prediction
-    latest = df.iloc[-1]
+    latest_log_return = log_returns[-1]
+    latest_vol = volatility[-1]
     
     # Predict next volatility using SVR
     svr_features = np.array([[
-        latest['Log_Returns'],
-        latest['Volatility'],
-        latest['Downside_Vol'],
+        latest_log_return,
+        latest_vol,
+        downside_vol[-1],
         current_regime
     ]])
     svr_features_scaled = svr_scaler.transform(svr_features)
@@ -409,15 +488,28 @@ def predict_regime_and_volatility(
         'regime': int(current_regime),
         'regime_label': 'Safe' if current_regime == 0 else ('Crash' if current_regime == n_states - 1 else 'Normal'),
         'predicted_vol': float(predicted_vol),
-        'current_vol': float(latest['Volatility']),
+        'current_vol': float(latest_vol),
         'risk_ratio': float(risk_ratio),
         'avg_train_vol': float(avg_train_vol),
         'n_states': n_states,
-        'log_return': float(latest['Log_Returns']),
-        'close_price': float(latest['Close'])
+        'log_return': float(latest_log_return),
+        'close_price': float(closes[-1])
     }
 
 
+def _ema(closes: np.ndarray, span: int) -> np.ndarray:
+    """
+    Exponential moving average of every point, matching pandas ewm(span=span).mean().
+    
+    The adjusted EMA at t is sum(decay^(t-i) * x_i) / sum(decay^(t-i)). Weighting
+    each price by decay^(n-1-i) scales numerator and denominator alike, so both
+    reduce to cumulative sums over the whole array.
+    """
+    decay = 1.0 - 2.0 / (span + 1)
+    weights = decay ** np.arange(len(closes) - 1, -1, -1, dtype=np.float64)
+    return np.cumsum(weights * closes) / np.cumsum(weights)
+
+
 def calculate_signal_and_position(
     symbol: str,
     recent_data: pd.DataFrame,
@@ -441,23 +533,21 @@ def calculate_signal_and_position(
     n_states = model_data['n_states']
     
     # Use sliding window for EMA calculation (matches backtest)
-    df = recent_data.copy()
-    lookback_data = df.iloc[-lookback_window:] if len(df) > lookback_window else df
+    closes = recent_data['Close'].to_numpy(dtype=np.float64)[-lookback_window:]
     
     # Calculate EMAs on sliding window only (not full history)
-    lookback_data_copy = lookback_data.copy()
-    lookback_data_copy['EMA_Short'] = lookback_data_copy['Close'].ewm(span=short_window).mean()
-    lookback_data_copy['EMA_Long'] = lookback_data_copy['Close'].ewm(span=long_window).mean()
+    ema_short = _ema(closes, short_window)
+    ema_long = _ema(closes, long_window)
     
-    latest = lookback_data_copy.iloc[-1]
+    latest_ema_short = float(ema_short[-1])
+    latest_ema_long = float(ema_long[-1])
     
     # EMA Crossover Signal (1 = bullish, 0 = bearish)
-    ema_signal = 1 if latest['EMA_Short'] > latest['EMA_Long'] else 0
+    ema_signal = 1 if latest_ema_short > latest_ema_long else 0
     
     # Calculate signal stability (how long has signal been consistent?)
-    if len(lookback_data_copy) >= 5:
-        recent_5_days = lookback_data_copy.tail(5)
-        recent_signals = (recent_5_days['EMA_Short'] > recent_5_days['EMA_Long']).astype(int)
+    if len(closes) >= 5:
+        recent_signals = ema_short[-5:] > ema_long[-5:]
         signal_stability = recent_signals.sum() / 5.0  # 1.0 = all bullish, 0.0 = all bearish
     else:
         signal_stability = 0.5
@@ -520,18 +610,18 @@ def calculate_signal_and_position(
     
     return {
         'ema_signal': ema_signal,
-        'ema_short': float(latest['EMA_Short']),
-        'ema_long': float(latest['EMA_Long']),
+        'ema_short': latest_ema_short,
+        'ema_long': latest_ema_long,
         'regime': regime,
         'regime_label': prediction['regime_label'],
         'predicted_vol': prediction['predicted_vol'],
         'risk_ratio': risk_ratio,
         'position_size_multiplier': position_size,
         'target_position': target_position,  # 0, 1, or 3
-        'close_price': float(latest['Close']),
+        'close_price': float(closes[-1]),
         'signal_stability': signal_stability,  # NEW: How stable is the signal?
         'reasoning': reasoning,
-        'ema_gap_percent': ((latest['EMA_Short'] - latest['EMA_Long']) / latest['EMA_Long'] * 100)  # NEW: Strength of trend
+        'ema_gap_percent': ((latest_ema_short - latest_ema_long) / latest_ema_long * 100)  # NEW: Strength of trend
     }
 
 
@@ -586,6 +676,9 @@ def _get_signal_reasoning(ema_signal: int, regime: int, risk_ratio: float,
 
 def get_cached_models() -> Dict[str, Dict]:
     """Get info about all cached models."""
+    # Snapshot first - training threads may add models while we build the dict
+    # (list() copies the items in one step under the GIL)
+    cached = list(_model_cache.items())
     return {
         symbol: {
             'trained_at': data.get('trained_at', 'Unknown'),
@@ -593,5 +686,5 @@ def get_cached_models() -> Dict[str, Dict]:
             'avg_train_vol': data.get('avg_train_vol', 0),
             'train_days': data.get('train_days', 0)
         }
-        for symbol, data in _model_cache.items()
+        for symbol, data in cached
     }
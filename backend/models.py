@@ -1,6 +1,7 @@
 # models.py
 from typing import Optional
 from datetime import datetime
+from sqlalchemy import Index
 from sqlmodel import Field, SQLModel
 
 class User(SQLModel, table=True):
@@ -11,6 +12,9 @@ class User(SQLModel, table=True):
 
 
 class TradingSession(SQLModel, table=True):
+    # Serves "sessions for user, newest first" without a sort
+    __table_args__ = (Index("ix_tradingsession_user_start", "user_email", "start_time"),)
+    
     id: Optional[int] = Field(default=None, primary_key=True)
     session_id: str = Field(index=True, unique=True)
     user_email: str = Field(index=True)
@@ -27,6 +31,9 @@ class TradingSession(SQLModel, table=True):
 
 
 class Trade(SQLModel, table=True):
+    # Serves "recent trades for user" (ORDER BY executed_at DESC LIMIT n) as an index range scan
+    __table_args__ = (Index("ix_trade_user_executed", "user_email", "executed_at"),)
+    
     id: Optional[int] = Field(default=None, primary_key=True)
     session_id: str = Field(index=True)
     user_email: str = Field(index=True)
@@ -1,92 +1,145 @@
 """
 Additional simulated trading endpoints for trades and sessions
+
+Both helpers take the request-scoped Session injected by the route
+(Depends(get_session)) instead of checking out their own connection.
 """
+import threading
+import time
+from sqlmodel import Session
+
+# The dashboard polls the sessions list; repeat polls within the TTL reuse the
+# last result. simulated_trading invalidates a user's entry on start/stop/expiry.
+SESSIONS_CACHE_TTL_SECONDS = 10.0
+_sessions_cache = {}  # user_email -> (expires_at, response)
+_sessions_generation = {}  # user_email -> number of invalidations
+_sessions_cache_lock = threading.Lock()
+
 
+def invalidate_sessions_cache(user_email: str):
+    """Drop a user's cached sessions list so the next poll sees a state change"""
+    with _sessions_cache_lock:
+        _sessions_cache.pop(user_email, None)
+        _sessions_generation[user_email] = _sessions_generation.get(user_email, 0) + 1
 
-def get_simulated_trades_endpoint(limit: int, current_user: str):
+
+def get_simulated_trades_endpoint(session: Session, limit: int, current_user: str):
     """Get recent simulated trades for the current user"""
     from models import Trade
-    from database import engine
-    from sqlmodel import Session, select
+    from sqlmodel import select
     
-    with Session(engine) as session:
-        statement = (
-            select(Trade)
-            .where(Trade.user_email == current_user)
-            .order_by(Trade.executed_at.desc())
-            .limit(limit)
-        )
-        trades = session.exec(statement).all()
-        
-        trades_list = [
-            {
-                "symbol": trade.symbol,
-                "side": trade.side,
-                "price": trade.price,
-                "quantity": trade.quantity,
-                "total": trade.total,
-                "time": trade.executed_at.isoformat()
-            }
-            for trade in trades
-        ]
-        
-        return {"trades": trades_list}
+    # Select only the columns we return - plain tuples skip ORM object construction
+    statement = (
+        select(Trade.symbol, Trade.side, Trade.price, Trade.quantity, Trade.total, Trade.executed_at)
+        .where(Trade.user_email == current_user)
+        .order_by(Trade.executed_at.desc())
+        .limit(limit)
+    )
+    
+    trades_list = [
+        {
+            "symbol": symbol,
+            "side": side,
+            "price": price,
+            "quantity": quantity,
+            "total": total,
+            "time": executed_at.isoformat()
+        }
+        for symbol, side, price, quantity, total, executed_at in session.exec(statement)
+    ]
+    
+    return {"trades": trades_list}
 
 
-def get_simulated_sessions_endpoint(current_user: str):
-    """Get all simulated trading sessions for the current user"""
+def get_simulated_sessions_endpoint(session: Session, current_user: str):
+    """Get all simulated trading sessions for the current user (cached briefly)"""
+    with _sessions_cache_lock:
+        cached = _sessions_cache.get(current_user)
+        generation = _sessions_generation.get(current_user, 0)
+    if cached and cached[0] > time.monotonic():
+        return cached[1]
+    
+    response = _load_simulated_sessions(session, current_user)
+    with _sessions_cache_lock:
+        # A start/stop during the query invalidated this user - the response
+        # may predate it, so serve it once but don't cache it
+        if _sessions_generation.get(current_user, 0) == generation:
+            now = time.monotonic()
+            # Prune expired entries so the cache only holds recently active users
+            expired = [email for email, (expires_at, _) in _sessions_cache.items() if expires_at <= now]
+            for email in expired:
+                del _sessions_cache[email]
+            _sessions_cache[current_user] = (now + SESSIONS_CACHE_TTL_SECONDS, response)
+    return response
+
+
+def _load_simulated_sessions(session: Session, current_user: str):
+    """Query the user's sessions and reconcile stale is_running flags"""
     from models import TradingSession
-    from database import engine
-    from sqlmodel import Session, select
+    from sqlalchemy import func, update
+    from sqlmodel import select
     from datetime import datetime
     from simulated_trading import simulated_sessions
     
-    with Session(engine) as session:
-        statement = (
-            select(TradingSession)
-            .where(TradingSession.user_email == current_user)
-            .order_by(TradingSession.start_time.desc())
+    # Select only the columns we read - plain rows, no ORM hydration
+    statement = (
+        select(
+            TradingSession.session_id, TradingSession.strategy, TradingSession.symbol,
+            TradingSession.trade_amount, TradingSession.is_running, TradingSession.trades_count,
+            TradingSession.total_pnl, TradingSession.start_time, TradingSession.duration_minutes,
+            TradingSession.duration_unit
         )
-        sessions = session.exec(statement).all()
+        .where(TradingSession.user_email == current_user)
+        .order_by(TradingSession.start_time.desc())
+    )
+    sessions = session.exec(statement).all()
+    
+    # One clock read for the whole list (and the stale-session end_time below)
+    now = datetime.now()
+    sessions_list = []
+    stale_session_ids = []
+    for s in sessions:
+        # Check if session is actually running in memory
+        is_actually_running = s.session_id in simulated_sessions
+        
+        # If DB says running but not in memory, it expired/crashed
+        if s.is_running and not is_actually_running:
+            stale_session_ids.append(s.session_id)
         
-        sessions_list = []
-        for s in sessions:
-            # Check if session is actually running in memory
-            is_actually_running = s.session_id in simulated_sessions
-            
-            # If DB says running but not in memory, it expired/crashed
-            if s.is_running and not is_actually_running:
-                # Update DB to reflect reality
-                s.is_running = False
-                if s.end_time is None:
-                    s.end_time = datetime.now()
-                session.add(s)
-            
-            # Calculate elapsed and remaining time
-            now = datetime.now()
-            elapsed = (now - s.start_time).total_seconds() / 60  # minutes
-            
-            # Calculate total duration based on duration_unit
-            if s.duration_unit == "days":
-                total_duration = s.duration_minutes * 24 * 60
-            else:
-                total_duration = s.duration_minutes
-            
-            remaining = max(0, total_duration - elapsed)
-            
-            sessions_list.append({
-                "session_id": s.session_id,
-                "strategy": s.strategy,
-                "symbol": s.symbol,
-                "trade_amount": s.trade_amount,
-                "is_running": is_actually_running,  # Use real status from memory
-                "position": "NONE",  # Default position
-                "trades_count": s.trades_count,
-                "pnl": s.total_pnl,
-                "elapsed_minutes": elapsed,
-                "remaining_minutes": remaining
-            })
+        # Calculate elapsed and remaining time
+        elapsed = (now - s.start_time).total_seconds() / 60  # minutes
         
-        session.commit()  # Commit any DB updates
+        # Calculate total duration based on duration_unit
+        if s.duration_unit == "days":
+            total_duration = s.duration_minutes * 24 * 60
+        else:
+            total_duration = s.duration_minutes
         
-        return {"sessions": sessions_list}
+        remaining = max(0, total_duration - elapsed)
+        
+        sessions_list.append({
+            "session_id": s.session_id,
+            "strategy": s.strategy,
+            "symbol": s.symbol,
+            "trade_amount": s.trade_amount,
+            "is_running": is_actually_running,  # Use real status from memory
+            "position": "NONE",  # Default position
+            "trades_count": s.trades_count,
+            "pnl": s.total_pnl,
+            "elapsed_minutes": elapsed,
+            "remaining_minutes": remaining
+        })
+    
+    # Update DB to reflect reality - one UPDATE for every stale session
+    if stale_session_ids:
+        session.exec(
+            update(TradingSession)
+            .where(TradingSession.session_id.in_(stale_session_ids))
+            .values(
+                is_running=False,
+                end_time=func.coalesce(TradingSession.end_time, now)
+            )
+        )
+        session.commit()
+    
+    return {"sessions": sessions_list}
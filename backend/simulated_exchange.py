@@ -2,16 +2,26 @@
 Simulated Exchange Service
 Manages internal portfolio and executes simulated trades against database
 """
-from typing import Optional, Tuple
+from datetime import datetime
+from functools import lru_cache
+from sqlalchemy import bindparam, insert, update
+from typing import Dict, List, Optional, Tuple
 from sqlmodel import Session, select
-from database import engine
-from models import PortfolioAsset
+from database import SessionLocal
+from models import PortfolioAsset, Trade, TradingSession
 from binance.client import Client
+from requests.adapters import HTTPAdapter
 import os
+import json
 from dotenv import load_dotenv
+import logging
+import threading
+import time
 
 load_dotenv()
 
+log = logging.getLogger(__name__)
+
 # Trading fee (0.1% as typical exchange fee)
 TRADING_FEE = 0.001
 
@@ -19,15 +29,44 @@ TRADING_FEE = 0.001
 TESTNET_API_KEY = os.getenv("BINANCE_API_KEY", "")
 TESTNET_API_SECRET = os.getenv("BINANCE_SECRET_KEY", "")
 
+# Recently fetched prices: (symbol, quote) -> (price, expires_at)
+# Bot sessions and trade execution ask for the same pair many times a minute
+PRICE_CACHE_TTL_SECONDS = 1.0
+_price_cache = {}
+_price_cache_lock = threading.Lock()
+
+# Portfolio row lookup built once at import - reusing the same statement object
+# lets SQLAlchemy's compiled-query cache hit without rebuilding the expression
+ASSET_BY_SYMBOL = select(PortfolioAsset).where(
+    PortfolioAsset.symbol == bindparam("symbol"),
+    PortfolioAsset.user_email == bindparam("user_email")
+)
+BALANCE_BY_SYMBOL = select(PortfolioAsset.balance).where(
+    PortfolioAsset.symbol == bindparam("symbol"),
+    PortfolioAsset.user_email == bindparam("user_email")
+)
+
 
+@lru_cache(maxsize=1)
 def get_binance_client():
-    """Get Binance client for fetching real-time market prices"""
-    return Client(TESTNET_API_KEY, TESTNET_API_SECRET, testnet=True)
+    """
+    Get Binance client for fetching real-time market prices
+    
+    The client is created once and shared, so its requests.Session keeps
+    connections alive instead of paying a new TCP/TLS handshake (and the
+    constructor's ping) on every price lookup.
+    """
+    client = Client(TESTNET_API_KEY, TESTNET_API_SECRET, testnet=True)
+    adapter = HTTPAdapter(pool_connections=20, pool_maxsize=50, max_retries=0)
+    client.session.mount('https://', adapter)
+    client.session.headers.update({'User-Agent': 'algoquant'})
+    return client
 
 
 def get_current_price(symbol: str, quote: str = "USDT") -> Optional[float]:
     """
-    Fetch current market price from Binance testnet (free) or Yahoo Finance fallback
+    Fetch current market price from Binance testnet (free) or Yahoo Finance fallback.
+    Prices are reused for PRICE_CACHE_TTL_SECONDS to absorb repeated lookups.
     
     Args:
         symbol: Base asset (e.g., 'BTC', 'ETH')
@@ -36,6 +75,56 @@ def get_current_price(symbol: str, quote: str = "USDT") -> Optional[float]:
     Returns:
         Current price or None if error
     """
+    cache_key = (symbol, quote)
+    with _price_cache_lock:
+        cached = _price_cache.get(cache_key)
+    if cached and cached[1] > time.monotonic():
+        return cached[0]
+    
+    price = _fetch_current_price(symbol, quote)
+    if price is not None:
+        with _price_cache_lock:
+            _price_cache[cache_key] = (price, time.monotonic() + PRICE_CACHE_TTL_SECONDS)
+    return price
+
+
+def get_prices(symbols: List[str], quote: str = "USDT") -> Dict[str, float]:
+    """
+    Fetch current prices for several assets with a single Binance request
+    
+    Args:
+        symbols: Base assets (e.g., ['BTC', 'ETH'])
+        quote: Quote asset (e.g., 'USDT')
+    
+    Returns:
+        Dictionary mapping base asset to price. Assets that could not be
+        priced are left out - the whole batch is empty if the request fails
+        (e.g. one pair isn't listed), so callers should fall back per asset.
+    """
+    pairs = {f"{symbol}{quote}": symbol for symbol in symbols}
+    if not pairs:
+        return {}
+    
+    try:
+        client = get_binance_client()
+        tickers = client.get_symbol_ticker(symbols=json.dumps(list(pairs), separators=(",", ":")))
+    except Exception as e:
+        log.warning("Batch price fetch failed for %s: %s", list(pairs), e)
+        return {}
+    
+    prices = {pairs[t['symbol']]: float(t['price']) for t in tickers if t['symbol'] in pairs}
+    
+    # Seed the single-price cache so follow-up get_current_price calls are free
+    expires_at = time.monotonic() + PRICE_CACHE_TTL_SECONDS
+    with _price_cache_lock:
+        for symbol, price in prices.items():
+            _price_cache[(symbol, quote)] = (price, expires_at)
+    
+    return prices
+
+
+def _fetch_current_price(symbol: str, quote: str) -> Optional[float]:
+    """Fetch a price from Binance, falling back to Yahoo Finance (uncached)"""
     # Try Binance testnet first (free API, no paid subscription needed)
     try:
         client = get_binance_client()
@@ -43,7 +132,7 @@ def get_current_price(symbol: str, quote: str = "USDT") -> Optional[float]:
         ticker = client.get_symbol_ticker(symbol=trading_pair)
         return float(ticker['price'])
     except Exception as e:
-        print(f"[SimEx] Binance fetch failed for {symbol}/{quote}, trying Yahoo Finance: {e}")
+        log.warning("Binance fetch failed for %s/%s, trying Yahoo Finance: %s", symbol, quote, e)
         
         # Fallback to Yahoo Finance (completely free, no API key needed)
         try:
@@ -57,10 +146,10 @@ def get_current_price(symbol: str, quote: str = "USDT") -> Optional[float]:
                 # Convert to USDT if needed (assuming USD ≈ USDT)
                 return price
             else:
-                print(f"[SimEx] ❌ No price data available for {symbol}/{quote}")
+                log.error("No price data available for %s/%s", symbol, quote)
                 return None
         except Exception as yf_error:
-            print(f"[SimEx] ❌ Yahoo Finance fallback failed: {yf_error}")
+            log.error("Yahoo Finance fallback failed: %s", yf_error)
             return None
 
 
@@ -75,13 +164,10 @@ def get_balance(symbol: str, user_email: str = "default_user") -> float:
     Returns:
         Current balance (0.0 if asset not found)
     """
-    with Session(engine) as session:
-        statement = select(PortfolioAsset).where(
-            PortfolioAsset.symbol == symbol,
-            PortfolioAsset.user_email == user_email
-        )
-        asset = session.exec(statement).first()
-        return asset.balance if asset else 0.0
+    with SessionLocal() as session:
+        # Single-column select - a plain float, no PortfolioAsset object to build
+        balance = session.exec(BALANCE_BY_SYMBOL, params={"symbol": symbol, "user_email": user_email}).first()
+        return balance if balance is not None else 0.0
 
 
 def update_balance(symbol: str, amount: float, user_email: str = "default_user") -> bool:
@@ -97,12 +183,8 @@ def update_balance(symbol: str, amount: float, user_email: str = "default_user")
         True if successful, False otherwise
     """
     try:
-        with Session(engine) as session:
-            statement = select(PortfolioAsset).where(
-                PortfolioAsset.symbol == symbol,
-                PortfolioAsset.user_email == user_email
-            )
-            asset = session.exec(statement).first()
+        with SessionLocal() as session:
+            asset = session.exec(ASSET_BY_SYMBOL, params={"symbol": symbol, "user_email": user_email}).first()
             
             if asset:
                 asset.balance += amount
@@ -118,8 +200,8 @@ def update_balance(symbol: str, amount: float, user_email: str = "default_user")
             
             session.commit()
             return True
-    except Exception as e:
-        print(f"[SimEx] Error updating balance for {symbol}: {e}")
+    except Exception:
+        log.exception("Error updating balance for %s", symbol)
         return False
 
 
@@ -127,7 +209,9 @@ def execute_buy(
     symbol: str, 
     quote_symbol: str, 
     amount_to_buy: float, 
-    user_email: str = "default_user"
+    user_email: str = "default_user",
+    trade_session_id: Optional[str] = None,
+    price: Optional[float] = None
 ) -> Tuple[bool, Optional[dict]]:
     """
     Execute a simulated BUY order
@@ -137,48 +221,45 @@ def execute_buy(
         quote_symbol: Asset to pay with (e.g., 'USDT')
         amount_to_buy: Quantity of symbol to buy
         user_email: User identifier
+        trade_session_id: If given, a Trade row for this session is written
+            in the same transaction as the balance changes
+        price: Execution price the caller already fetched (skips the lookup)
     
     Returns:
         Tuple of (success: bool, trade_info: dict or None)
     """
     # Get current market price
-    price = get_current_price(symbol, quote_symbol)
     if price is None:
-        print(f"[SimEx] ❌ BUY failed: Could not fetch price for {symbol}/{quote_symbol}")
-        return False, None
+        price = get_current_price(symbol, quote_symbol)
+        if price is None:
+            log.error("BUY failed: could not fetch price for %s/%s", symbol, quote_symbol)
+            return False, None
     
     # Calculate cost including fee
     cost_before_fee = price * amount_to_buy
     fee = cost_before_fee * TRADING_FEE
     total_cost = cost_before_fee + fee
     
-    # Check if we have enough quote currency
-    quote_balance = get_balance(quote_symbol, user_email)
-    
-    if quote_balance < total_cost:
-        print(f"[SimEx] ❌ BUY failed: Insufficient {quote_symbol}")
-        print(f"  Required: {total_cost:.2f} {quote_symbol}")
-        print(f"  Available: {quote_balance:.2f} {quote_symbol}")
-        return False, None
-    
-    # Execute trade in database transaction
+    # Check balance and execute trade in one database session/transaction
     try:
-        with Session(engine) as session:
+        with SessionLocal() as session:
+            quote_asset = session.exec(ASSET_BY_SYMBOL, params={"symbol": quote_symbol, "user_email": user_email}).first()
+            
+            # Check if we have enough quote currency
+            quote_balance = quote_asset.balance if quote_asset else 0.0
+            if quote_balance < total_cost:
+                log.warning(
+                    "BUY failed: insufficient %s (required %.2f, available %.2f)",
+                    quote_symbol, total_cost, quote_balance
+                )
+                return False, None
+            
             # Deduct quote currency
-            quote_stmt = select(PortfolioAsset).where(
-                PortfolioAsset.symbol == quote_symbol,
-                PortfolioAsset.user_email == user_email
-            )
-            quote_asset = session.exec(quote_stmt).first()
             quote_asset.balance -= total_cost
             session.add(quote_asset)
             
             # Add purchased asset
-            symbol_stmt = select(PortfolioAsset).where(
-                PortfolioAsset.symbol == symbol,
-                PortfolioAsset.user_email == user_email
-            )
-            symbol_asset = session.exec(symbol_stmt).first()
+            symbol_asset = session.exec(ASSET_BY_SYMBOL, params={"symbol": symbol, "user_email": user_email}).first()
             
             if symbol_asset:
                 symbol_asset.balance += amount_to_buy
@@ -191,8 +272,6 @@ def execute_buy(
                 )
                 session.add(new_asset)
             
-            session.commit()
-            
             trade_info = {
                 'symbol': f"{symbol}{quote_symbol}",
                 'side': 'BUY',
@@ -202,22 +281,32 @@ def execute_buy(
                 'fee': fee,
                 'total': total_cost
             }
+            if trade_session_id:
+                _insert_trade(session, trade_session_id, user_email, trade_info)
+            
+            session.commit()
             
-            print(f"[SimEx] ✅ BUY executed: {amount_to_buy:.8f} {symbol} @ {price:.2f} {quote_symbol}")
-            print(f"  Cost: {cost_before_fee:.2f} + Fee: {fee:.2f} = {total_cost:.2f} {quote_symbol}")
+            log.info(
+                "BUY executed: %.8f %s @ %.2f %s | Cost: %.2f + Fee: %.2f = %.2f %s",
+                amount_to_buy, symbol, price, quote_symbol,
+                cost_before_fee, fee, total_cost, quote_symbol
+            )
             
             return True, trade_info
             
-    except Exception as e:
-        print(f"[SimEx] ❌ BUY transaction failed: {e}")
+    except Exception:
+        log.exception("BUY transaction failed")
         return False, None
 
 
 def execute_sell(
     symbol: str, 
     quote_symbol: str, 
-    amount_to_sell: float, 
-    user_email: str = "default_user"
+    amount_to_sell: Optional[float], 
+    user_email: str = "default_user",
+    trade_session_id: Optional[str] = None,
+    entry_price: Optional[float] = None,
+    price: Optional[float] = None
 ) -> Tuple[bool, Optional[dict]]:
     """
     Execute a simulated SELL order
@@ -225,50 +314,58 @@ def execute_sell(
     Args:
         symbol: Asset to sell (e.g., 'BTC', 'ETH')
         quote_symbol: Asset to receive (e.g., 'USDT')
-        amount_to_sell: Quantity of symbol to sell
+        amount_to_sell: Quantity of symbol to sell, or None to sell the whole
+            balance (read inside the trade transaction)
         user_email: User identifier
+        trade_session_id: If given, a Trade row for this session is written
+            in the same transaction as the balance changes
+        entry_price: If given, realized P&L ((price - entry_price) * quantity)
+            is stored on that Trade row and returned as trade_info['pnl']
+        price: Execution price the caller already fetched (skips the lookup)
     
     Returns:
         Tuple of (success: bool, trade_info: dict or None)
     """
     # Get current market price
-    price = get_current_price(symbol, quote_symbol)
     if price is None:
-        print(f"[SimEx] ❌ SELL failed: Could not fetch price for {symbol}/{quote_symbol}")
-        return False, None
-    
-    # Check if we have enough asset to sell
-    symbol_balance = get_balance(symbol, user_email)
+        price = get_current_price(symbol, quote_symbol)
+        if price is None:
+            log.error("SELL failed: could not fetch price for %s/%s", symbol, quote_symbol)
+            return False, None
     
-    if symbol_balance < amount_to_sell:
-        print(f"[SimEx] ❌ SELL failed: Insufficient {symbol}")
-        print(f"  Required: {amount_to_sell:.8f} {symbol}")
-        print(f"  Available: {symbol_balance:.8f} {symbol}")
-        return False, None
-    
-    # Calculate proceeds after fee
-    proceeds_before_fee = price * amount_to_sell
-    fee = proceeds_before_fee * TRADING_FEE
-    net_proceeds = proceeds_before_fee - fee
-    
-    # Execute trade in database transaction
+    # Check balance and execute trade in one database session/transaction
     try:
-        with Session(engine) as session:
+        with SessionLocal() as session:
+            symbol_asset = session.exec(ASSET_BY_SYMBOL, params={"symbol": symbol, "user_email": user_email}).first()
+            
+            symbol_balance = symbol_asset.balance if symbol_asset else 0.0
+            if amount_to_sell is None:
+                # Sell everything held (ignoring dust)
+                if symbol_balance <= 0.00001:
+                    log.warning("SELL skipped: no %s balance to sell", symbol)
+                    return False, None
+                amount_to_sell = symbol_balance
+            
+            # Check if we have enough asset to sell
+            if symbol_balance < amount_to_sell:
+                log.warning(
+                    "SELL failed: insufficient %s (required %.8f, available %.8f)",
+                    symbol, amount_to_sell, symbol_balance
+                )
+                return False, None
+            
+            # Calculate proceeds after fee
+            proceeds_before_fee = price * amount_to_sell
+            fee = proceeds_before_fee * TRADING_FEE
+            net_proceeds = proceeds_before_fee - fee
+            pnl = (price - entry_price) * amount_to_sell if entry_price is not None else None
+            
             # Deduct sold asset
-            symbol_stmt = select(PortfolioAsset).where(
-                PortfolioAsset.symbol == symbol,
-                PortfolioAsset.user_email == user_email
-            )
-            symbol_asset = session.exec(symbol_stmt).first()
             symbol_asset.balance -= amount_to_sell
             session.add(symbol_asset)
             
             # Add quote currency proceeds
-            quote_stmt = select(PortfolioAsset).where(
-                PortfolioAsset.symbol == quote_symbol,
-                PortfolioAsset.user_email == user_email
-            )
-            quote_asset = session.exec(quote_stmt).first()
+            quote_asset = session.exec(ASSET_BY_SYMBOL, params={"symbol": quote_symbol, "user_email": user_email}).first()
             
             if quote_asset:
                 quote_asset.balance += net_proceeds
@@ -281,8 +378,6 @@ def execute_sell(
                 )
                 session.add(new_asset)
             
-            session.commit()
-            
             trade_info = {
                 'symbol': f"{symbol}{quote_symbol}",
                 'side': 'SELL',
@@ -290,22 +385,57 @@ def execute_sell(
                 'quantity': amount_to_sell,
                 'proceeds': proceeds_before_fee,
                 'fee': fee,
-                'total': net_proceeds
+                'total': net_proceeds,
+                'pnl': pnl
             }
+            if trade_session_id:
+                _insert_trade(session, trade_session_id, user_email, trade_info, pnl)
             
-            print(f"[SimEx] ✅ SELL executed: {amount_to_sell:.8f} {symbol} @ {price:.2f} {quote_symbol}")
-            print(f"  Proceeds: {proceeds_before_fee:.2f} - Fee: {fee:.2f} = {net_proceeds:.2f} {quote_symbol}")
+            session.commit()
+            
+            log.info(
+                "SELL executed: %.8f %s @ %.2f %s | Proceeds: %.2f - Fee: %.2f = %.2f %s",
+                amount_to_sell, symbol, price, quote_symbol,
+                proceeds_before_fee, fee, net_proceeds, quote_symbol
+            )
             
             return True, trade_info
             
-    except Exception as e:
-        print(f"[SimEx] ❌ SELL transaction failed: {e}")
+    except Exception:
+        log.exception("SELL transaction failed")
         return False, None
 
 
+def _insert_trade(session: Session, trade_session_id: str, user_email: str,
+                  trade_info: dict, pnl: Optional[float] = None):
+    """
+    Add a Trade row to the caller's transaction (Core INSERT, nothing reads it
+    back) and bump the owning TradingSession's running totals in the same commit
+    """
+    session.exec(insert(Trade).values(
+        session_id=trade_session_id,
+        user_email=user_email,
+        symbol=trade_info['symbol'],
+        side=trade_info['side'],
+        price=trade_info['price'],
+        quantity=trade_info['quantity'],
+        total=trade_info['total'],
+        pnl=pnl,
+        executed_at=datetime.now()
+    ))
+    session.exec(
+        update(TradingSession)
+        .where(TradingSession.session_id == trade_session_id)
+        .values(
+            trades_count=TradingSession.trades_count + 1,
+            total_pnl=TradingSession.total_pnl + (pnl or 0.0)
+        )
+    )
+
+
 def get_portfolio_summary(user_email: str = "default_user") -> dict:
     """
-    Get complete portfolio summary with current values (OPTIMIZED - only fetch needed symbols)
+    Get complete portfolio summary with current values (one batched price request)
     
     Args:
         user_email: User identifier
@@ -313,51 +443,53 @@ def get_portfolio_summary(user_email: str = "default_user") -> dict:
     Returns:
         Dictionary with portfolio details
     """
-    with Session(engine) as session:
-        statement = select(PortfolioAsset).where(PortfolioAsset.user_email == user_email)
+    # Read plain (symbol, balance) rows and release the connection before the
+    # price request - the pool slot isn't held across the Binance round-trip
+    with SessionLocal() as session:
+        statement = select(PortfolioAsset.symbol, PortfolioAsset.balance).where(
+            PortfolioAsset.user_email == user_email
+        )
         assets = session.exec(statement).all()
-        
-        # Build list of symbols to fetch (ONLY what user holds - very light API usage)
-        symbols_to_fetch = [f"{asset.symbol}USDT" for asset in assets 
-                           if asset.balance > 0.00000001 and asset.symbol != "USDT"]
-        
-        # Batch fetch ONLY needed prices (API weight: 2 per symbol, much safer!)
-        price_map = {}
-        if symbols_to_fetch:
-            try:
-                client = get_binance_client()
-                # Use bookTicker for minimal weight (weight=1 per symbol vs weight=40 for all)
-                for symbol in symbols_to_fetch:
-                    try:
-                        ticker = client.get_symbol_ticker(symbol=symbol)
-                        price_map[symbol] = float(ticker['price'])
-                    except Exception as e:
-                        print(f"[SimEx] Price fetch failed for {symbol}: {e}")
-            except Exception as e:
-                print(f"[SimEx] Failed to fetch prices: {e}")
-        
-        portfolio = []
-        total_value_usdt = 0.0
-        
-        for asset in assets:
-            if asset.balance > 0.00000001:  # Ignore dust
-                if asset.symbol == "USDT":
-                    value_usdt = asset.balance
-                else:
-                    # Use pre-fetched price from batch call
-                    trading_pair = f"{asset.symbol}USDT"
-                    price = price_map.get(trading_pair, 0.0)
-                    value_usdt = asset.balance * price if price else 0.0
-                
-                portfolio.append({
-                    'symbol': asset.symbol,
-                    'balance': asset.balance,
-                    'value_usdt': value_usdt
-                })
-                total_value_usdt += value_usdt
-        
-        return {
-            'assets': portfolio,
-            'total_value_usdt': total_value_usdt,
-            'user_email': user_email
-        }
+    
+    # Only hit the API if the user holds something besides USDT
+    held_symbols = {asset.symbol for asset in assets
+                    if asset.balance > 0.00000001 and asset.symbol != "USDT"}
+    
+    # One request for just the held pairs (also seeds the short-lived price
+    # cache) instead of a round-trip per holding or the full ~2,000-ticker list
+    price_map = get_prices(list(held_symbols)) if held_symbols else {}
+    if len(price_map) < len(held_symbols):
+        # Binance rejects the whole batch if one pair isn't listed - fall back to
+        # the all-tickers list, keeping only the pairs we need
+        try:
+            client = get_binance_client()
+            wanted = {f"{symbol}USDT": symbol for symbol in held_symbols}
+            price_map = {wanted[t['symbol']]: float(t['price'])
+                         for t in client.get_all_tickers() if t['symbol'] in wanted}
+        except Exception as e:
+            log.warning("Failed to fetch prices: %s", e)
+    
+    portfolio = []
+    total_value_usdt = 0.0
+    
+    for asset in assets:
+        if asset.balance > 0.00000001:  # Ignore dust
+            if asset.symbol == "USDT":
+                value_usdt = asset.balance
+            else:
+                # Use pre-fetched price from batch call
+                price = price_map.get(asset.symbol, 0.0)
+                value_usdt = asset.balance * price if price else 0.0
+            
+            portfolio.append({
+                'symbol': asset.symbol,
+                'balance': asset.balance,
+                'value_usdt': value_usdt
+            })
+            total_value_usdt += value_usdt
+    
+    return {
+        'assets': portfolio,
+        'total_value_usdt': total_value_usdt,
+        'user_email': user_email
+    }
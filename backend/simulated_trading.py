@@ -3,19 +3,67 @@ HMM-SVR Trading Bot with Simulated Exchange
 Long-term trading strategy using HMM regime detection and SVR volatility prediction.
 Checks for trading signals every 3 hours - designed for position trading, not high-frequency.
 """
+import logging
+import threading
+import time
+from dataclasses import asdict, dataclass
 from datetime import datetime, timedelta
 from typing import Optional
+from apscheduler.executors.pool import ThreadPoolExecutor
+from apscheduler.jobstores.base import JobLookupError
 from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.triggers.date import DateTrigger
 from apscheduler.triggers.interval import IntervalTrigger
 import simulated_exchange
-from models import TradingSession, Trade
-from sqlmodel import Session, select
-from database import engine
+from models import TradingSession
+from sqlalchemy import update
+from database import SessionLocal
 import uuid
 from strategy_handlers import HMMSVRStrategyHandler
+from simulated_endpoints import invalidate_sessions_cache
 
-# Active trading sessions
+log = logging.getLogger(__name__)
+
+# Active trading sessions - copy-on-write: writers rebuild the dict under
+# _sessions_write_lock and rebind the name, so readers never need the lock.
+# Import it inside the function that reads it (as simulated_endpoints does);
+# a module-level import would keep a stale snapshot.
 simulated_sessions = {}
+_sessions_write_lock = threading.Lock()
+
+# One scheduler (one timer thread + worker pool) shared by every bot session,
+# instead of each session starting its own BackgroundScheduler threads.
+# Checks spend most of their time waiting on Binance, so a small bounded pool
+# serves any number of sessions; a check that overruns or misses its slot is
+# merged into one run rather than queued behind itself.
+_scheduler = BackgroundScheduler(
+    executors={"default": ThreadPoolExecutor(max_workers=8)},
+    job_defaults={"coalesce": True, "max_instances": 1, "misfire_grace_time": 300}
+)
+_scheduler_lock = threading.Lock()
+
+
+def _get_scheduler() -> BackgroundScheduler:
+    """Return the shared scheduler, starting it on first use"""
+    with _scheduler_lock:
+        if not _scheduler.running:
+            _scheduler.start()
+    return _scheduler
+
+
+@dataclass(frozen=True, slots=True)
+class StatusSnapshot:
+    """Immutable copy of a session's status fields, replaced whole on every change"""
+    session_id: str
+    strategy: str
+    symbol: str
+    is_running: bool
+    position: Optional[str]
+    entry_price: Optional[float]
+    trades_count: int
+    total_pnl: float
+    start_time: str
+    end_time: str
 
 
 class SimulatedTradingSession:
@@ -45,6 +93,9 @@ class SimulatedTradingSession:
         self.is_running = True
         self.start_time = datetime.now()
         self.end_time = self.start_time + timedelta(minutes=duration_minutes)
+        # Elapsed/expiry math uses the monotonic clock - immune to NTP/wall-clock jumps
+        self.started_at = time.monotonic()
+        self.deadline = self.started_at + duration_minutes * 60
         self.total_pnl = 0.0
         self.trades_count = 0
         self.position = None  # None or 'LONG' (no SHORT for long-term strategy)
@@ -59,26 +110,22 @@ class SimulatedTradingSession:
         try:
             self.handler = HMMSVRStrategyHandler(symbol=self.base_asset)
             print(f"[HMM-SVR Bot] ✅ Strategy initialized")
-        except Exception as e:
-            print(f"[HMM-SVR Bot] ❌ Init failed: {e}")
+        except Exception:
+            log.exception("Strategy init failed for %s", symbol)
             raise
         
-        # Scheduler - checks every 3 hours
-        self.scheduler = BackgroundScheduler()
-        self.scheduler.add_job(
-            func=self._trading_loop,
-            trigger=IntervalTrigger(hours=3),
-            id=f"hmm_svr_{session_id}",
-            name=f"HMM-SVR Bot - {symbol}",
-            replace_existing=True
-        )
+        # Jobs on the shared scheduler (registered in start())
+        self.loop_job_id = f"hmm_svr_{session_id}"
+        self.expire_job_id = f"hmm_svr_expire_{session_id}"
+        
+        self._publish_status()
         
         print(f"[HMM-SVR Bot] Session created | Duration: {duration_minutes}min | Amount: ${trade_amount}")
     
     def _ensure_model_trained(self):
         """Check if model exists, train if not"""
         try:
-            from model_manager import load_model, train_and_save_model
+            from model_manager import load_model, ensure_model_trained
             
             # Check if model exists
             model_data = load_model(self.base_asset)
@@ -87,43 +134,76 @@ class SimulatedTradingSession:
                 print(f"[HMM-SVR Bot] 🔄 No model found for {self.base_asset}, training now...")
                 print(f"[HMM-SVR Bot] ⏳ Training on historical data (this may take 30-60 seconds)...")
                 
-                # Train model
-                result = train_and_save_model(self.base_asset, n_states=3)
+                # Train model (or wait for a concurrent session already training it)
+                result = ensure_model_trained(self.base_asset, n_states=3)
                 
-                if result and 'error' not in result:
+                if result is None:
+                    # A model file already exists - either another session just
+                    # trained it or the load above failed to unpickle it
+                    if load_model(self.base_asset) is not None:
+                        print(f"[HMM-SVR Bot] ✅ Model trained by another session for {self.base_asset}")
+                    else:
+                        log.error("Model file for %s exists but could not be loaded", self.base_asset)
+                elif 'error' not in result:
                     print(f"[HMM-SVR Bot] ✅ Model trained successfully for {self.base_asset}")
                 else:
-                    error_msg = result.get('error', 'Unknown error') if result else 'Training failed'
-                    print(f"[HMM-SVR Bot] ⚠️ Model training failed: {error_msg}")
+                    print(f"[HMM-SVR Bot] ⚠️ Model training failed: {result['error']}")
             else:
                 print(f"[HMM-SVR Bot] ✅ Model already trained for {self.base_asset}")
                 
-        except Exception as e:
-            print(f"[HMM-SVR Bot] ⚠️ Error checking/training model: {e}")
+        except Exception:
+            log.exception("Error checking/training model for %s", self.base_asset)
     
     def start(self):
         """Start the trading bot"""
-        self.scheduler.start()
+        scheduler = _get_scheduler()
+        # Scheduler - checks every 3 hours
+        scheduler.add_job(
+            func=self._trading_loop,
+            trigger=IntervalTrigger(hours=3),
+            id=self.loop_job_id,
+            name=f"HMM-SVR Bot - {self.symbol}",
+            replace_existing=True
+        )
+        # One-shot expiry at end_time - otherwise a session only notices it has
+        # expired on the next 3-hour check and keeps running until then
+        scheduler.add_job(
+            func=self._expire,
+            trigger=DateTrigger(run_date=self.end_time),
+            id=self.expire_job_id,
+            name=f"HMM-SVR Bot expiry - {self.symbol}",
+            replace_existing=True
+        )
         self._trading_loop()  # First check immediately
         print(f"[HMM-SVR Bot] ✅ Started - next check in 3 hours")
     
     def stop(self, close_positions: bool = False):
         """Stop the trading bot"""
         self.is_running = False
-        self.scheduler.shutdown(wait=False)
+        for job_id in (self.loop_job_id, self.expire_job_id):
+            try:
+                _scheduler.remove_job(job_id)
+            except JobLookupError:
+                pass  # Already fired (expiry) or never registered
         
         if close_positions and self.position:
             self._close_position()
+        self._publish_status()
         
         print(f"[HMM-SVR Bot] ⏹️ Stopped | Trades: {self.trades_count} | P&L: ${self.total_pnl:.2f}")
     
+    def _expire(self):
+        """Stop the session as soon as its duration is up"""
+        if self.is_running:
+            _cleanup_expired_session(self.session_id)
+    
     def _trading_loop(self):
         """Main check - runs every 3 hours"""
         try:
             if not self.is_running:
                 return
             
-            if datetime.now() >= self.end_time:
+            if time.monotonic() >= self.deadline:
                 print(f"[HMM-SVR Bot] Session expired")
                 _cleanup_expired_session(self.session_id)
                 return
@@ -138,7 +218,7 @@ class SimulatedTradingSession:
             signal, position_size = self.handler.get_signal(price)
             
             # Log check
-            elapsed_hours = (datetime.now() - self.start_time).total_seconds() / 3600
+            elapsed_hours = (time.monotonic() - self.started_at) / 3600
             position_str = self.position or 'NONE'
             print(f"[HMM-SVR Bot] ⏰ Check | {elapsed_hours:.1f}h | ${price:,.2f} | {signal} {position_size}x | Pos: {position_str}")
             
@@ -148,8 +228,8 @@ class SimulatedTradingSession:
             elif signal == "SELL" and self.position == "LONG":
                 self._close_position(price)
             
-        except Exception as e:
-            print(f"[HMM-SVR Bot] ❌ Error: {e}")
+        except Exception:
+            log.exception("Trading check failed for session %s", self.session_id)
     
     def _open_long_position(self, price: float, position_size: float = 1.0):
         """Open a LONG position (BUY) with leverage multiplier"""
@@ -161,13 +241,16 @@ class SimulatedTradingSession:
             symbol=self.base_asset,
             quote_symbol=self.quote_asset,
             amount_to_buy=quantity,
-            user_email=self.user_email
+            user_email=self.user_email,
+            trade_session_id=self.session_id,
+            price=price
         )
         
         if success:
             self.position = "LONG"
             self.entry_price = price
-            self._save_trade_to_db(trade_info)
+            self.trades_count += 1
+            self._publish_status()
             leverage_str = f" ({position_size}x)" if position_size != 1.0 else ""
             print(f"[HMM-SVR Bot] 📈 LONG opened: {quantity:.8f} {self.base_asset} @ ${price:,.2f}{leverage_str}")
         else:
@@ -183,65 +266,79 @@ class SimulatedTradingSession:
             if current_price is None:
                 return
         
-        # Sell all holdings to close position
-        balance = simulated_exchange.get_balance(self.base_asset, self.user_email)
-        if balance > 0.00001:
-            success, trade_info = simulated_exchange.execute_sell(
-                symbol=self.base_asset,
-                quote_symbol=self.quote_asset,
-                amount_to_sell=balance,
-                user_email=self.user_email
-            )
-            if success:
-                pnl = (current_price - self.entry_price) * balance
-                self.total_pnl += pnl
-                self._save_trade_to_db(trade_info, pnl=pnl)
-                print(f"[HMM-SVR Bot] ✅ LONG closed | P&L: ${pnl:.2f}")
-            else:
-                print(f"[HMM-SVR Bot] ❌ Failed to close position")
+        # Sell all holdings to close position - the exchange reads the balance
+        # inside the sell transaction and prices it at current_price
+        success, trade_info = simulated_exchange.execute_sell(
+            symbol=self.base_asset,
+            quote_symbol=self.quote_asset,
+            amount_to_sell=None,
+            user_email=self.user_email,
+            trade_session_id=self.session_id,
+            entry_price=self.entry_price,
+            price=current_price
+        )
+        if success:
+            pnl = trade_info['pnl']
+            self.total_pnl += pnl
+            self.trades_count += 1
+            print(f"[HMM-SVR Bot] ✅ LONG closed | P&L: ${pnl:.2f}")
+        else:
+            print(f"[HMM-SVR Bot] ❌ Failed to close position")
         
         self.position = None
         self.entry_price = None
+        self._publish_status()
     
-    def _save_trade_to_db(self, trade_info: dict, pnl: Optional[float] = None):
-        """Save trade to database"""
-        try:
-            with Session(engine) as session:
-                trade = Trade(
-                    session_id=self.session_id,
-                    user_email=self.user_email,
-                    symbol=trade_info['symbol'],
-                    side=trade_info['side'],
-                    price=trade_info['price'],
-                    quantity=trade_info['quantity'],
-                    total=trade_info.get('total', trade_info.get('cost', 0)),
-                    pnl=pnl,
-                    executed_at=datetime.now()
-                )
-                session.add(trade)
-                session.commit()
-                
-                # Only increment after successful DB save
-                self.trades_count += 1
-                
-        except Exception as e:
-            print(f"[SimTrading] Error saving trade: {e}")
+    def _publish_status(self):
+        """
+        Publish a fresh StatusSnapshot after the bot changes its state.
+        Status polls read the last snapshot by reference, so they never see a
+        half-applied trade (e.g. position cleared but P&L not yet added).
+        """
+        self._status = StatusSnapshot(
+            session_id=self.session_id,
+            strategy=self.strategy,
+            symbol=self.symbol,
+            is_running=self.is_running,
+            position=self.position,
+            entry_price=self.entry_price,
+            trades_count=self.trades_count,
+            total_pnl=self.total_pnl,
+            start_time=self.start_time.isoformat(),
+            end_time=self.end_time.isoformat()
+        )
     
     def get_status(self) -> dict:
         """Get current session status"""
-        return {
-            'session_id': self.session_id,
-            'strategy': self.strategy,
-            'symbol': self.symbol,
-            'is_running': self.is_running,
-            'position': self.position,
-            'entry_price': self.entry_price,
-            'trades_count': self.trades_count,
-            'total_pnl': self.total_pnl,
-            'start_time': self.start_time.isoformat(),
-            'end_time': self.end_time.isoformat(),
-            'time_remaining': max(0, (self.end_time - datetime.now()).total_seconds())
-        }
+        status = asdict(self._status)
+        status['time_remaining'] = max(0, self.deadline - time.monotonic())
+        return status
+
+
+def _register_session(session_id: str, session: "SimulatedTradingSession"):
+    """Publish a new session to simulated_sessions (copy-on-write)"""
+    global simulated_sessions
+    with _sessions_write_lock:
+        updated = dict(simulated_sessions)
+        updated[session_id] = session
+        simulated_sessions = updated
+
+
+def _pop_session(session_id: str) -> Optional["SimulatedTradingSession"]:
+    """
+    Remove a session from simulated_sessions (copy-on-write)
+    
+    Returns:
+        The removed session, or None if another caller already removed it
+    """
+    global simulated_sessions
+    with _sessions_write_lock:
+        if session_id not in simulated_sessions:
+            return None
+        updated = dict(simulated_sessions)
+        session = updated.pop(session_id)
+        simulated_sessions = updated
+    return session
 
 
 def start_simulated_trading(user_email: str, symbol: str,
@@ -269,13 +366,14 @@ def start_simulated_trading(user_email: str, symbol: str,
         duration_minutes=duration_minutes
     )
     
-    session.start()
-    simulated_sessions[session_id] = session
-    print(f"[HMM-SVR Bot] ✅ Session {session_id} active")
+    # Register before inserting the row - a sessions-list poll that saw the
+    # running DB row without its in-memory session would mark it stopped
+    _register_session(session_id, session)
     
-    # Save to database
+    # Save to database before the first check runs - trades update this row's
+    # totals in their own transaction, so it has to exist already
     try:
-        with Session(engine) as db_session:
+        with SessionLocal() as db_session:
             db_trading_session = TradingSession(
                 session_id=session_id,
                 user_email=user_email,
@@ -283,13 +381,17 @@ def start_simulated_trading(user_email: str, symbol: str,
                 symbol=symbol,
                 trade_amount=trade_amount,
                 duration_minutes=duration_minutes,
-                start_time=datetime.now(),
+                start_time=session.start_time,
                 is_running=True
             )
             db_session.add(db_trading_session)
             db_session.commit()
-    except Exception as e:
-        print(f"[HMM-SVR Bot] DB error: {e}")
+    except Exception:
+        log.exception("Failed to save session %s to DB", session_id)
+    
+    session.start()
+    print(f"[HMM-SVR Bot] ✅ Session {session_id} active")
+    invalidate_sessions_cache(user_email)
     
     return {
         'session_id': session_id,
@@ -298,55 +400,51 @@ def start_simulated_trading(user_email: str, symbol: str,
     }
 
 
+def _mark_session_stopped(session_id: str, total_pnl: float, trades_count: int):
+    """Record final session stats in the database with a single UPDATE"""
+    try:
+        with SessionLocal() as db_session:
+            db_session.exec(
+                update(TradingSession)
+                .where(TradingSession.session_id == session_id)
+                .values(
+                    is_running=False,
+                    end_time=datetime.now(),
+                    total_pnl=total_pnl,
+                    trades_count=trades_count
+                )
+            )
+            db_session.commit()
+    except Exception:
+        log.exception("Failed to mark session %s stopped in DB", session_id)
+
+
 def _cleanup_expired_session(session_id: str):
     """Clean up expired session"""
-    if session_id in simulated_sessions:
-        session = simulated_sessions[session_id]
-        session.stop(close_positions=False)
-        
-        # Update database
-        try:
-            with Session(engine) as db_session:
-                stmt = select(TradingSession).where(TradingSession.session_id == session_id)
-                db_trading_session = db_session.exec(stmt).first()
-                if db_trading_session:
-                    db_trading_session.is_running = False
-                    db_trading_session.end_time = datetime.now()
-                    db_trading_session.total_pnl = session.total_pnl
-                    db_trading_session.trades_count = session.trades_count
-                    db_session.add(db_trading_session)
-                    db_session.commit()
-        except Exception as e:
-            print(f"[HMM-SVR Bot] DB error: {e}")
-        
-        del simulated_sessions[session_id]
-        print(f"[HMM-SVR Bot] Session expired")
+    # Popping first means an expiry racing a manual stop is handled only once
+    session = _pop_session(session_id)
+    if session is None:
+        return
+    
+    session.stop(close_positions=False)
+    
+    # Update database
+    _mark_session_stopped(session_id, session.total_pnl, session.trades_count)
+    invalidate_sessions_cache(session.user_email)
+    print(f"[HMM-SVR Bot] Session expired")
 
 
 def stop_simulated_trading(session_id: str, close_positions: bool = False) -> dict:
     """Stop trading bot session"""
-    if session_id not in simulated_sessions:
+    session = _pop_session(session_id)
+    if session is None:
         return {'error': 'Session not found'}
     
-    session = simulated_sessions[session_id]
     session.stop(close_positions=close_positions)
     
     # Update database
-    try:
-        with Session(engine) as db_session:
-            stmt = select(TradingSession).where(TradingSession.session_id == session_id)
-            db_trading_session = db_session.exec(stmt).first()
-            if db_trading_session:
-                db_trading_session.is_running = False
-                db_trading_session.end_time = datetime.now()
-                db_trading_session.total_pnl = session.total_pnl
-                db_trading_session.trades_count = session.trades_count
-                db_session.add(db_trading_session)
-                db_session.commit()
-    except Exception as e:
-        print(f"[HMM-SVR Bot] DB error: {e}")
-    
-    del simulated_sessions[session_id]
+    _mark_session_stopped(session_id, session.total_pnl, session.trades_count)
+    invalidate_sessions_cache(session.user_email)
     
     return {
         'session_id': session_id,
@@ -358,7 +456,8 @@ def stop_simulated_trading(session_id: str, close_positions: bool = False) -> di
 
 def get_simulated_session_status(session_id: str) -> dict:
     """Get bot session status"""
-    if session_id not in simulated_sessions:
+    session = simulated_sessions.get(session_id)
+    if session is None:
         return {'error': 'Session not found'}
     
-    return simulated_sessions[session_id].get_status()
+    return session.get_status()
@@ -1,16 +1,17 @@
 import yfinance as yf
 import pandas as pd
 import numpy as np
-from hmmlearn.hmm import GaussianHMM
-from sklearn.svm import SVR
-from sklearn.preprocessing import StandardScaler
 from datetime import datetime
 import joblib
 import os
+from model_manager import train_hmm_model, train_svr_model
+
+# Annualization factor for daily return ratios (252 trading days)
+ANNUALIZATION_FACTOR = np.sqrt(252)
 
 def fetch_data(ticker, start_date, end_date):
     # FIXED: Added auto_adjust=True to clean up data splits/dividends automatically
-    df = yf.download(ticker, start=start_date, end=end_date, progress=False, auto_adjust=True)
+    df = yf.download(ticker, start=start_date, end=end_date, progress=False, auto_adjust=True, threads=False)
     
     if df.empty: return None
     
@@ -22,8 +23,9 @@ def fetch_data(ticker, start_date, end_date):
         else:
             # Fallback for (Ticker, Price) format
             df.columns = df.columns.get_level_values(1)
-            
-    return df.dropna()
+    
+    # The backtest only uses Close - drop the other OHLCV columns
+    return df[['Close']].dropna()
 
 def generate_trade_log(df):
     """
@@ -37,22 +39,27 @@ def generate_trade_log(df):
     trade_returns = []
     avg_leverage = []
     
-    for date, row in df.iterrows():
-        pos = row['Final_Position']
-        close_price = row['Close']
-        lev = row['Position_Size']
-        
+    # Walk plain column arrays - iterrows() builds a pandas Series for every row
+    rows = zip(
+        df.index,
+        df['Final_Position'].to_numpy(),
+        df['Close'].to_numpy(),
+        df['Position_Size'].to_numpy(),
+        df['Strategy_Returns'].to_numpy()
+    )
+    
+    for date, pos, close_price, lev, strategy_return in rows:
         # Check for Entry
         if pos > 0 and not in_trade:
             in_trade = True
             entry_date = date
             entry_price = close_price
-            trade_returns = [row['Strategy_Returns']]
+            trade_returns = [strategy_return]
             avg_leverage = [lev]
             
         # Check for adjustments while in trade
         elif pos > 0 and in_trade:
-            trade_returns.append(row['Strategy_Returns'])
+            trade_returns.append(strategy_return)
             avg_leverage.append(lev)
             
         # Check for Exit
@@ -62,7 +69,7 @@ def generate_trade_log(df):
             exit_price = close_price
             
             # Calculate compounded return
-            cum_trade_ret = np.prod([1 + r for r in trade_returns]) - 1
+            cum_trade_ret = np.prod(1 + np.asarray(trade_returns)) - 1
             mean_lev = np.mean(avg_leverage)
             
             trades.append({
@@ -80,7 +87,7 @@ def generate_trade_log(df):
 
     # Handle Open Trade
     if in_trade:
-        cum_trade_ret = np.prod([1 + r for r in trade_returns]) - 1
+        cum_trade_ret = np.prod(1 + np.asarray(trade_returns)) - 1
         mean_lev = np.mean(avg_leverage)
         trades.append({
             'entry_date': entry_date,
@@ -96,49 +103,16 @@ def generate_trade_log(df):
     return trades
 
 
-def train_hmm_model(train_df, n_states=3):
+def rolling_window_ema(windows, span):
     """
-    Trains HMM on historical data and sorts states by volatility.
-    State 0 = Lowest Volatility (Safe)
-    State N-1 = Highest Volatility (Crash)
+    Adjusted EMA (same as pandas ewm(span=span).mean()) at the last row of each window.
+    `windows` is a 2-D array with one lookback window per row, oldest price first.
     """
-    X_train = train_df[['Log_Returns', 'Volatility']].values * 100
-    
-    model = GaussianHMM(n_components=n_states, covariance_type="full", n_iter=100, random_state=42)
-    model.fit(X_train)
-    
-    # Calculate average volatility per state
-    hidden_states = model.predict(X_train)
-    state_vol = []
-    for i in range(n_states):
-        avg_vol = X_train[hidden_states == i, 1].mean()
-        state_vol.append((i, avg_vol))
-    
-    # Sort states by volatility: State 0 = Lowest, State N-1 = Highest
-    state_vol.sort(key=lambda x: x[1])
-    mapping = {old: new for new, (old, _) in enumerate(state_vol)}
-    
-    return model, mapping
+    decay = 1 - 2 / (span + 1)
+    weights = decay ** np.arange(windows.shape[1] - 1, -1, -1)
+    return windows @ weights / weights.sum()
 
 
-def train_svr_model(train_df):
-    """
-    Trains SVR to predict next day's volatility.
-    """
-    feature_cols = ['Log_Returns', 'Volatility', 'Downside_Vol', 'Regime']
-    target_col = 'Target_Next_Vol'
-    
-    X = train_df[feature_cols].values
-    y = train_df[target_col].values
-    
-    scaler = StandardScaler()
-    X_scaled = scaler.fit_transform(X)
-    
-    model = SVR(kernel='rbf', C=100, gamma=0.1, epsilon=0.01)
-    model.fit(X_scaled, y)
-    
-    return model, scaler
-
 def train_models_and_backtest(ticker, start_date, end_date, short_window, long_window, n_states):
     """
     HMM-SVR Honest Leverage Strategy (Walk-Forward):
@@ -157,7 +131,7 @@ def train_models_and_backtest(ticker, start_date, end_date, short_window, long_w
     df['Volatility'] = df['Log_Returns'].rolling(window=10).std()
     
     # Downside volatility (std of negative returns only)
-    df['Downside_Returns'] = df['Log_Returns'].apply(lambda x: x if x < 0 else 0)
+    df['Downside_Returns'] = df['Log_Returns'].where(df['Log_Returns'] < 0, 0)
     df['Downside_Vol'] = df['Downside_Returns'].rolling(10).std()
     
     # SVR target: next day's volatility
@@ -180,7 +154,8 @@ def train_models_and_backtest(ticker, start_date, end_date, short_window, long_w
     # Predict regimes on train and remap
     X_train = train_df[['Log_Returns', 'Volatility']].values * 100
     train_regimes = hmm_model.predict(X_train)
-    train_df['Regime'] = [state_mapping[s] for s in train_regimes]
+    regime_lookup = np.array([state_mapping[s] for s in range(n_states)])
+    train_df['Regime'] = regime_lookup[train_regimes]
     
     # Calculate average training volatility for risk ratio
     avg_train_vol = train_df['Volatility'].mean()
@@ -210,9 +185,6 @@ def train_models_and_backtest(ticker, start_date, end_date, short_window, long_w
     
     # Prepare containers for honest predictions
     honest_regimes = []
-    honest_predicted_vols = []
-    honest_ema_short = []
-    honest_ema_long = []
     
     # Concatenate for sliding window access
     all_data = pd.concat([train_df, test_df])
@@ -220,6 +192,18 @@ def train_models_and_backtest(ticker, start_date, end_date, short_window, long_w
     total_steps = len(test_df)
     lookback_window = 252  # 1 year lookback for regime detection
     
+    # C. Honest EMA Calculation (uses only history)
+    # Training split is >= 365 days, so every test day sees a full lookback window
+    # and all EMAs can be computed at once as a matrix-vector product over the windows
+    closes = all_data['Close'].to_numpy(dtype=np.float64)
+    history_windows = np.lib.stride_tricks.sliding_window_view(closes, lookback_window + 1)
+    history_windows = history_windows[start_idx - lookback_window:]
+    honest_ema_short = rolling_window_ema(history_windows, short_window)
+    honest_ema_long = rolling_window_ema(history_windows, long_window)
+    
+    # HMM inputs are loop-invariant: scale once, then slice each day's window
+    hmm_features = all_data[['Log_Returns', 'Volatility']].to_numpy() * 100
+    
     # Walk forward one day at a time
     for i in range(total_steps):
         # Progress indicator
@@ -230,11 +214,8 @@ def train_models_and_backtest(ticker, start_date, end_date, short_window, long_w
         curr_pointer = start_idx + i
         window_start = max(0, curr_pointer - lookback_window)
         
-        # Slice history up to current day (inclusive)
-        history_slice = all_data.iloc[window_start : curr_pointer + 1]
-        
-        # A. Honest Regime Detection (uses only history)
-        X_slice = history_slice[['Log_Returns', 'Volatility']].values * 100
+        # A. Honest Regime Detection (uses only history up to current day, inclusive)
+        X_slice = hmm_features[window_start : curr_pointer + 1]
         try:
             hidden_states_slice = hmm_model.predict(X_slice)
             current_state_raw = hidden_states_slice[-1]
@@ -243,25 +224,15 @@ def train_models_and_backtest(ticker, start_date, end_date, short_window, long_w
             current_state = 1  # Fallback to neutral
         
         honest_regimes.append(current_state)
-        
-        # B. Honest Volatility Prediction (uses today's data to predict tomorrow)
-        row = test_df.iloc[i]
-        svr_features = np.array([[
-            row['Log_Returns'], 
-            row['Volatility'], 
-            row['Downside_Vol'], 
-            current_state
-        ]])
-        
-        svr_feat_scaled = svr_scaler.transform(svr_features)
-        pred_vol = svr_model.predict(svr_feat_scaled)[0]
-        honest_predicted_vols.append(pred_vol)
-        
-        # C. Honest EMA Calculation (uses only history)
-        ema_short_val = history_slice['Close'].ewm(span=short_window).mean().iloc[-1]
-        ema_long_val = history_slice['Close'].ewm(span=long_window).mean().iloc[-1]
-        honest_ema_short.append(ema_short_val)
-        honest_ema_long.append(ema_long_val)
+    
+    # B. Honest Volatility Prediction (uses today's data to predict tomorrow)
+    # Each day's features are that day's row plus its walk-forward regime, so the
+    # SVR can score every day in one batched transform/predict call
+    svr_features = np.column_stack([
+        test_df[['Log_Returns', 'Volatility', 'Downside_Vol']].to_numpy(),
+        honest_regimes
+    ])
+    honest_predicted_vols = svr_model.predict(svr_scaler.transform(svr_features))
     
     print(f"✅ Walk-forward simulation complete!")
     
@@ -316,67 +287,81 @@ def train_models_and_backtest(ticker, start_date, end_date, short_window, long_w
             'regime': int(test_df.loc[trade['entry_date'], 'Regime']) if trade['entry_date'] in test_df.index else 0
         })
 
-    # 9. JSON Response - Chart Data
-    chart_data = []
-    for date, row in test_df.iterrows():
-        chart_data.append({
-            'date': date.strftime('%Y-%m-%d'),
-            'strategy': float(row['Strategy_Equity']),
-            'buy_hold': float(row['BuyHold_Equity']),
-            'regime': int(row['Regime']),
-            'leverage': float(row['Position_Size'])
-        })
+    # 9. JSON Response - Chart Data (dates formatted in one pass over the index)
+    chart_rows = zip(
+        test_df.index.strftime('%Y-%m-%d'),
+        test_df['Strategy_Equity'].tolist(),
+        test_df['BuyHold_Equity'].tolist(),
+        test_df['Regime'].astype(int).tolist(),
+        test_df['Position_Size'].tolist()
+    )
+    chart_data = [
+        {
+            'date': date,
+            'strategy': strategy_value,
+            'buy_hold': buy_hold_value,
+            'regime': regime,
+            'leverage': leverage
+        }
+        for date, strategy_value, buy_hold_value, regime, leverage in chart_rows
+    ]
 
-    # 10. Calculate Advanced Metrics
-    strat_total = test_df['Strategy_Equity'].iloc[-1] - 1
-    bh_total = test_df['BuyHold_Equity'].iloc[-1] - 1
+    # 10. Calculate Advanced Metrics (on raw NumPy arrays)
+    strategy_equity = test_df['Strategy_Equity'].to_numpy()
+    bh_equity = test_df['BuyHold_Equity'].to_numpy()
+    strat_total = strategy_equity[-1] - 1
+    bh_total = bh_equity[-1] - 1
     
-    strategy_returns = test_df['Strategy_Returns'].dropna()
-    sharpe = (strategy_returns.mean() / strategy_returns.std()) * np.sqrt(252) if strategy_returns.std() != 0 else 0
+    strategy_returns = test_df['Strategy_Returns'].dropna().to_numpy()
+    returns_mean = strategy_returns.mean()
+    returns_std = strategy_returns.std(ddof=1)
+    sharpe = (returns_mean / returns_std) * ANNUALIZATION_FACTOR if returns_std != 0 else 0
     
     # Max Drawdown
-    rolling_max_strategy = test_df['Strategy_Equity'].cummax()
-    drawdown_strategy = (test_df['Strategy_Equity'] - rolling_max_strategy) / rolling_max_strategy
-    max_drawdown_strategy = drawdown_strategy.min()
+    rolling_max_strategy = np.maximum.accumulate(strategy_equity)
+    max_drawdown_strategy = ((strategy_equity - rolling_max_strategy) / rolling_max_strategy).min()
     
-    rolling_max_bh = test_df['BuyHold_Equity'].cummax()
-    drawdown_bh = (test_df['BuyHold_Equity'] - rolling_max_bh) / rolling_max_bh
-    max_drawdown_bh = drawdown_bh.min()
+    rolling_max_bh = np.maximum.accumulate(bh_equity)
+    max_drawdown_bh = ((bh_equity - rolling_max_bh) / rolling_max_bh).min()
     
-    # Win Rate Calculation
-    closed_trades = [t for t in trades_list if t['exit_date'] != test_df.index[-1]]
-    winning_closed_trades = [t for t in closed_trades if t['trade_pnl'] > 0]
+    # Per-trade PnL array + mask of trades closed before the end of the test period
+    last_date = test_df.index[-1]
+    trade_pnls = np.array([t['trade_pnl'] for t in trades_list], dtype=np.float64)
+    closed_mask = np.array([t['exit_date'] != last_date for t in trades_list], dtype=bool)
     
-    win_rate = (len(winning_closed_trades) / len(closed_trades) * 100) if closed_trades else 0
+    # Win Rate Calculation
+    closed_pnls = trade_pnls[closed_mask]
+    win_rate = (np.count_nonzero(closed_pnls > 0) / closed_pnls.size * 100) if closed_pnls.size else 0
     
     # Sortino Ratio
     negative_returns = strategy_returns[strategy_returns < 0]
-    downside_std = negative_returns.std() if len(negative_returns) > 0 else 0
-    sortino = (strategy_returns.mean() / downside_std) * np.sqrt(252) if downside_std != 0 else 0
+    downside_std = negative_returns.std(ddof=1) if negative_returns.size > 0 else 0
+    sortino = (returns_mean / downside_std) * ANNUALIZATION_FACTOR if downside_std != 0 else 0
     
     # Profit Factor (All trades including open ones)
-    winning_trades = [t for t in trades_list if t['trade_pnl'] > 0]
-    losing_trades = [t for t in trades_list if t['trade_pnl'] < 0]
+    winning_pnls = trade_pnls[trade_pnls > 0]
+    losing_pnls = trade_pnls[trade_pnls < 0]
     
-    total_wins = sum([t['trade_pnl'] for t in winning_trades]) if winning_trades else 0
-    total_losses = abs(sum([t['trade_pnl'] for t in losing_trades])) if losing_trades else 0
+    total_wins = winning_pnls.sum()
+    total_losses = abs(losing_pnls.sum())
     profit_factor = total_wins / total_losses if total_losses != 0 else (float('inf') if total_wins > 0 else 0)
     
     # Risk Reward
-    avg_win = (total_wins / len(winning_trades)) if winning_trades else 0
-    avg_loss = (total_losses / len(losing_trades)) if losing_trades else 0
+    avg_win = winning_pnls.mean() if winning_pnls.size else 0
+    avg_loss = (total_losses / losing_pnls.size) if losing_pnls.size else 0
     risk_reward = avg_win / avg_loss if avg_loss != 0 else 0
     
     recovery_factor = abs(strat_total / max_drawdown_strategy) if max_drawdown_strategy != 0 else 0
     
     # Average leverage used
-    avg_leverage_used = test_df[test_df['Final_Position'] > 0]['Position_Size'].mean() if (test_df['Final_Position'] > 0).any() else 0
+    in_market = test_df['Final_Position'].to_numpy() > 0
+    avg_leverage_used = test_df['Position_Size'].to_numpy()[in_market].mean() if in_market.any() else 0
 
     return {
         "metrics": {
             "strategy_return": f"{strat_total:.2%}",
             "buy_hold_return": f"{bh_total:.2%}",
-            "final_value": f"${test_df['Strategy_Equity'].iloc[-1] * 10000:.2f}",
+            "final_value": f"${strategy_equity[-1] * 10000:.2f}",
             "sharpe_ratio": f"{sharpe:.2f}",
             "sortino_ratio": f"{sortino:.2f}",
             "max_drawdown": f"{max_drawdown_strategy:.2%}",
@@ -3,10 +3,56 @@ HMM-SVR Strategy Handler
 Long-term trading strategy using regime detection and volatility prediction.
 Checks every 3 hours - designed for position trading.
 """
+import logging
+import threading
+import time
+import numpy as np
 import pandas as pd
 from collections import deque
 from datetime import datetime, timedelta
 
+log = logging.getLogger(__name__)
+
+# Daily closes shared by every handler on the same ticker.
+# Sessions on one symbol reuse a single download instead of each pulling
+# 450 days from Yahoo Finance; daily bars only change once a day.
+HISTORY_CACHE_TTL_SECONDS = 3600
+_history_cache = {}  # ticker_symbol -> (fetched_at, closes)
+_history_locks = {}
+_history_locks_guard = threading.Lock()
+
+
+def get_daily_closes(ticker_symbol: str) -> np.ndarray:
+    """Return up to 400 recent daily closes for a Yahoo Finance ticker (cached)."""
+    cached = _history_cache.get(ticker_symbol)
+    if cached and time.monotonic() - cached[0] < HISTORY_CACHE_TTL_SECONDS:
+        return cached[1]
+    
+    with _history_locks_guard:
+        lock = _history_locks.setdefault(ticker_symbol, threading.Lock())
+    
+    # One download per ticker; concurrent handlers wait for it and share the result
+    with lock:
+        cached = _history_cache.get(ticker_symbol)
+        if cached and time.monotonic() - cached[0] < HISTORY_CACHE_TTL_SECONDS:
+            return cached[1]
+        
+        import yfinance as yf
+        
+        # Fetch 450 days of daily data
+        ticker = yf.Ticker(ticker_symbol)
+        end_date = datetime.now()
+        start_date = end_date - timedelta(days=450)
+        hist = ticker.history(start=start_date, end=end_date, interval="1d")
+        
+        if hist.empty:
+            return np.empty(0)
+        
+        # One vectorized cast for the whole column instead of float() per price
+        closes = hist['Close'].dropna().to_numpy(dtype=np.float64)[-400:]
+        _history_cache[ticker_symbol] = (time.monotonic(), closes)
+        return closes
+
 
 class HMMSVRStrategyHandler:
     """
@@ -19,6 +65,20 @@ class HMMSVRStrategyHandler:
     SHORT_WINDOW = 12
     LONG_WINDOW = 26
     
+    # Binance symbol -> Yahoo Finance ticker (built once at class load)
+    YAHOO_TICKERS = {
+        "BTC": "BTC-USD",
+        "BTCUSDT": "BTC-USD",
+        "ETH": "ETH-USD",
+        "ETHUSDT": "ETH-USD",
+        "BNB": "BNB-USD",
+        "BNBUSDT": "BNB-USD",
+        "SOL": "SOL-USD",
+        "SOLUSDT": "SOL-USD",
+        "LINK": "LINK-USD",
+        "LINKUSDT": "LINK-USD"
+    }
+    
     def __init__(self, symbol: str):
         self.symbol = symbol
         
@@ -34,43 +94,22 @@ class HMMSVRStrategyHandler:
     def _preload_historical_data(self):
         """Pre-load historical price data from Yahoo Finance."""
         try:
-            import yfinance as yf
-            
             # Map symbol to Yahoo Finance ticker
-            symbol_map = {
-                "BTC": "BTC-USD",
-                "BTCUSDT": "BTC-USD",
-                "ETH": "ETH-USD",
-                "ETHUSDT": "ETH-USD",
-                "BNB": "BNB-USD",
-                "BNBUSDT": "BNB-USD",
-                "SOL": "SOL-USD",
-                "SOLUSDT": "SOL-USD",
-                "LINK": "LINK-USD",
-                "LINKUSDT": "LINK-USD"
-            }
-            
-            ticker_symbol = symbol_map.get(self.symbol.upper(), f"{self.symbol.replace('USDT', '')}-USD")
+            ticker_symbol = self.YAHOO_TICKERS.get(self.symbol.upper(), f"{self.symbol.replace('USDT', '')}-USD")
             
-            # Fetch 450 days of daily data
-            ticker = yf.Ticker(ticker_symbol)
-            end_date = datetime.now()
-            start_date = end_date - timedelta(days=450)
-            hist = ticker.history(start=start_date, end=end_date, interval="1d")
+            prices = get_daily_closes(ticker_symbol)
             
-            if hist.empty:
+            if len(prices) == 0:
                 print(f"[HMM-SVR] ⚠️ No historical data for {ticker_symbol}")
                 return
             
             # Load last 400 prices into buffer
-            prices = hist['Close'].dropna().values
-            for price in prices[-400:]:
-                self.price_buffer.append(float(price))
+            self.price_buffer.extend(prices.tolist())
             
             print(f"[HMM-SVR] ✅ Loaded {len(self.price_buffer)} prices")
             
-        except Exception as e:
-            print(f"[HMM-SVR] ⚠️ Error loading historical data: {e}")
+        except Exception:
+            log.exception("Error loading historical data for %s", self.symbol)
     
     def get_signal(self, price: float) -> tuple[str, float]:
         """
@@ -89,8 +128,10 @@ class HMMSVRStrategyHandler:
             return "HOLD", 0.0
         
         try:
-            # Convert buffer to DataFrame for model
-            df = pd.DataFrame({'Close': list(self.price_buffer)})
+            # Convert buffer to DataFrame for model (straight into a float64 array,
+            # no intermediate list of Python floats)
+            closes = np.fromiter(self.price_buffer, dtype=np.float64, count=len(self.price_buffer))
+            df = pd.DataFrame({'Close': closes})
             
             # Get signal from model_manager
             from model_manager import calculate_signal_and_position
@@ -125,6 +166,6 @@ class HMMSVRStrategyHandler:
             self.last_position_size = target_position
             return signal, target_position
             
-        except Exception as e:
-            print(f"[HMM-SVR] Error generating signal: {e}")
+        except Exception:
+            log.exception("Error generating signal for %s", self.symbol)
             return "HOLD", self.last_position_size